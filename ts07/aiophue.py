@@ -0,0 +1,495 @@
+# -*- coding: utf-8 -*-
+#
+# asyncio client for the Philips Hue bridge
+#
+# Speaks the same REST API as ts07.phue.Bridge over asyncio streams with keep-alive connections,
+# so a single event loop can drive several bridges and the UFO controllers without a thread per
+# call. Requires Python 3.7+.
+
+import asyncio
+import json
+from logging import getLogger
+
+from .phue import (GROUP_COMMAND_COST, RETRY_METHODS, PhueException, PhueRequestTimeout, Scene,
+                   TokenBucket, default_config_file_path, is_string)
+
+logger = getLogger('phue')
+
+
+class AsyncBridge(object):
+    """A Hue bridge client that keeps up to ``pool_size`` HTTP connections open.
+
+    Every API call is a coroutine; calls on one bridge share its connections and run
+    concurrently up to ``pool_size`` at a time. set_light and set_group pace their requests to
+    ``command_rate`` light commands per second.
+
+        >>> async with AsyncBridge('10.0.1.103') as bridge:
+        ...     await bridge.set_light([1, 2, 3], dict(on=True, bri=254))
+
+    """
+
+    def __init__(self, ip=None, username=None, config_file_path=None, pool_size=4,
+                 timeout=10.0, command_rate=10.0):
+        self.config_file_path = config_file_path or default_config_file_path()
+        if ip is None or username is None:
+            ip, username = self._read_config(ip, username)
+        self.ip = ip
+        self.username = username
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.command_rate = command_rate
+        self.rate_limit = TokenBucket(command_rate)
+        self._idle = []
+        self._slots = asyncio.Semaphore(pool_size)
+        self._names = {}  # 'lights'|'groups'|'sensors' -> {name: id}
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.ip)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _read_config(self, ip, username):
+        # The ip and username saved by phue.Bridge.register_app
+        try:
+            with open(self.config_file_path) as f:
+                config = json.loads(f.read())
+            if ip is None:
+                ip = list(config.keys())[0]
+            if username is None:
+                username = config[ip]['username']
+        except Exception:
+            raise PhueException(None, 'No username for the bridge in %s; register with '
+                                      'phue.Bridge first' % self.config_file_path)
+        return ip, username
+
+    # HTTP #####
+
+    async def _connect(self, fresh=False):
+        while self._idle and not fresh:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        host, _, port = self.ip.partition(':')
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, int(port or 80)), self.timeout)
+        except asyncio.TimeoutError:
+            error = "Connecting to {} timed out.".format(self.ip)
+            logger.error(error)
+            raise PhueRequestTimeout(None, error)
+        return reader, writer, False
+
+    async def _exchange(self, reader, writer, mode, address, body):
+        # One request/response on an open connection. Returns (data, keep_alive).
+        head = '{0} {1} HTTP/1.1\r\nHost: {2}\r\nContent-Length: {3}\r\n'.format(
+            mode, address, self.ip, len(body))
+        if body:
+            head += 'Content-Type: application/json\r\n'
+        writer.write(head.encode('latin-1') + b'\r\n' + body)
+        await writer.drain()
+
+        status = await reader.readline()
+        if not status:
+            raise ConnectionResetError('bridge closed the connection')
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip().lower()
+        keep_alive = (headers.get('connection') != 'close' and
+                      (status.startswith(b'HTTP/1.1') or headers.get('connection') == 'keep-alive'))
+
+        if headers.get('transfer-encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            data = b''.join(chunks)
+        elif 'content-length' in headers:
+            data = await reader.readexactly(int(headers['content-length']))
+        else:
+            data = await reader.read()
+            keep_alive = False
+        return data, keep_alive
+
+    async def request(self, mode='GET', address=None, data=None):
+        """ Send one request to the API and return the decoded JSON response """
+        body = b''
+        if mode == 'PUT' or mode == 'POST':
+            body = json.dumps(data).encode('utf-8')
+
+        async with self._slots:
+            # Retry once over a fresh connection if a kept-open one turns out to be dead, unless
+            # the request is a POST; see RETRY_METHODS.
+            for attempt in (0, 1):
+                reader, writer, reused = await self._connect(fresh=mode not in RETRY_METHODS)
+                try:
+                    response, keep_alive = await asyncio.wait_for(
+                        self._exchange(reader, writer, mode, address, body), self.timeout)
+                except asyncio.TimeoutError:
+                    writer.close()
+                    error = "{} Request to {}{} timed out.".format(mode, self.ip, address)
+                    logger.error(error)
+                    raise PhueRequestTimeout(None, error)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    if not reused or attempt or mode not in RETRY_METHODS:
+                        raise
+                    logger.debug("Reconnecting to {0} after connection reset".format(self.ip))
+                    continue
+                except BaseException:
+                    # e.g. cancelled by gather or wait_for; the response may be half read
+                    writer.close()
+                    raise
+                logger.debug("{0} {1} {2}".format(mode, address, str(data)))
+                if keep_alive:
+                    self._idle.append((reader, writer))
+                else:
+                    writer.close()
+                break
+        return json.loads(response.decode('utf-8'))
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for reader, writer in idle:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    def _url(self, *parts):
+        return '/'.join(('/api', self.username) + tuple(str(x) for x in parts))
+
+    async def _acquire(self, cost=1):
+        # no more than command_rate light commands per second
+        while True:
+            delay = self.rate_limit.try_acquire(cost)
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+    async def _dispatch(self, send, targets, cost=1):
+        # Call send(target) for every target concurrently. Repeats of one target run in order.
+        # Returns results in the order of targets; a request that raised becomes a bridge-style
+        # error entry.
+        async def run(indexes):
+            results = []
+            for index in indexes:
+                await self._acquire(cost)
+                try:
+                    results.append(await send(targets[index]))
+                except Exception as e:
+                    logger.warning("ERROR: {0!r} for {1}".format(e, targets[index]))
+                    results.append([{'error': {
+                        'type': None, 'address': str(targets[index]), 'description': str(e)}}])
+            return results
+
+        by_target = {}
+        for index, target in enumerate(targets):
+            by_target.setdefault(str(target), []).append(index)
+        runs = list(by_target.values())
+        result = [None] * len(targets)
+        for indexes, values in zip(runs, await asyncio.gather(*(run(x) for x in runs))):
+            for index, value in zip(indexes, values):
+                result[index] = value
+        return result
+
+    # Names #####
+
+    async def _get_collection(self, resource):
+        collection = await self.request('GET', self._url(resource, ''))
+        if isinstance(collection, dict):
+            self._names[resource] = dict(
+                (info['name'], resource_id) for resource_id, info in collection.items()
+                if isinstance(info, dict) and 'name' in info)
+        return collection
+
+    async def _lookup(self, resource, name):
+        resource_id = self._names.get(resource, {}).get(name)
+        if resource_id is None:
+            await self._get_collection(resource)
+            resource_id = self._names.get(resource, {}).get(name)
+        return False if resource_id is None else resource_id
+
+    async def get_light_id_by_name(self, name):
+        """ Lookup a light id based on string name. Case-sensitive. """
+        return await self._lookup('lights', name)
+
+    async def get_group_id_by_name(self, name):
+        """ Lookup a group id based on string name. Case-sensitive. """
+        return await self._lookup('groups', name)
+
+    async def get_sensor_id_by_name(self, name):
+        """ Lookup a sensor id based on string name. Case-sensitive. """
+        return await self._lookup('sensors', name)
+
+    # Bridge #####
+
+    async def get_api(self):
+        """ Returns the full api dictionary """
+        return await self.request('GET', self._url())
+
+    async def get_name(self):
+        return (await self.request('GET', self._url('config')))['name']
+
+    async def set_name(self, value):
+        return await self.request('PUT', self._url('config'), {'name': value})
+
+    # Lights #####
+
+    async def get_light(self, light_id=None, parameter=None):
+        """ Gets state by light_id and parameter"""
+        if is_string(light_id):
+            light_id = await self.get_light_id_by_name(light_id)
+        if light_id is None:
+            return await self._get_collection('lights')
+        state = await self.request('GET', self._url('lights', light_id))
+        if parameter is None:
+            return state
+        if parameter in ['name', 'type', 'uniqueid', 'swversion']:
+            return state[parameter]
+        try:
+            return state['state'][parameter]
+        except KeyError:
+            raise KeyError('Not a valid key, parameter %s is not associated with light %s)'
+                           % (parameter, light_id))
+
+    async def set_light(self, light_id, parameter, value=None, transitiontime=None):
+        """ Adjust properties of one or more lights; see phue.Bridge.set_light
+
+        The requests for a list of lights are sent concurrently. Returns one response per light,
+        in the order given.
+        """
+        data = dict(parameter) if isinstance(parameter, dict) else {parameter: value}
+        if transitiontime is not None:
+            data['transitiontime'] = int(round(transitiontime))
+
+        async def send(light):
+            if is_string(light):
+                light = await self.get_light_id_by_name(light)
+            if parameter == 'name':
+                response = await self.request('PUT', self._url('lights', light), data)
+            else:
+                response = await self.request('PUT', self._url('lights', light, 'state'), data)
+            if 'error' in response[0]:
+                logger.warning("ERROR: {0} for light {1}".format(
+                    response[0]['error']['description'], light))
+            elif parameter == 'name':
+                self._names.pop('lights', None)
+            return response
+
+        if isinstance(light_id, int) or is_string(light_id):
+            return [await send(light_id)]
+        return await self._dispatch(send, list(light_id))
+
+    # Groups #####
+
+    async def get_group(self, group_id=None, parameter=None):
+        if is_string(group_id):
+            group_id = await self.get_group_id_by_name(group_id)
+        if group_id is False:
+            logger.error('Group name does not exit')
+            return
+        if group_id is None:
+            return await self._get_collection('groups')
+        group = await self.request('GET', self._url('groups', group_id))
+        if parameter is None:
+            return group
+        elif parameter == 'name' or parameter == 'lights':
+            return group[parameter]
+        else:
+            return group['action'][parameter]
+
+    async def set_group(self, group_id, parameter, value=None, transitiontime=None):
+        """ Change light settings for one or more groups; see phue.Bridge.set_group """
+        if isinstance(parameter, dict):
+            data = dict(parameter)
+        elif parameter == 'lights' and (isinstance(value, list) or isinstance(value, int)):
+            if isinstance(value, int):
+                value = [value]
+            data = {parameter: [str(x) for x in value]}
+        else:
+            data = {parameter: value}
+        if transitiontime is not None:
+            data['transitiontime'] = int(round(transitiontime))
+
+        async def send(group):
+            if is_string(group):
+                group = await self.get_group_id_by_name(group)
+                if group is False:
+                    raise LookupError('Group name does not exit')
+            if parameter == 'name' or parameter == 'lights':
+                response = await self.request('PUT', self._url('groups', group), data)
+                if parameter == 'name':
+                    self._names.pop('groups', None)
+            else:
+                response = await self.request('PUT', self._url('groups', group, 'action'), data)
+            if 'error' in response[0]:
+                logger.warning("ERROR: {0} for group {1}".format(
+                    response[0]['error']['description'], group))
+            return response
+
+        if isinstance(group_id, int) or is_string(group_id):
+            return [await send(group_id)]
+        return await self._dispatch(send, list(group_id), GROUP_COMMAND_COST)
+
+    async def create_group(self, name, lights=None):
+        data = {'lights': [str(x) for x in lights], 'name': name}
+        self._names.pop('groups', None)
+        return await self.request('POST', self._url('groups', ''), data)
+
+    async def delete_group(self, group_id):
+        self._names.pop('groups', None)
+        return await self.request('DELETE', self._url('groups', group_id))
+
+    # Sensors #####
+
+    async def get_sensor(self, sensor_id=None, parameter=None):
+        """ Gets state by sensor_id and parameter"""
+        if is_string(sensor_id):
+            sensor_id = await self.get_sensor_id_by_name(sensor_id)
+        if sensor_id is None:
+            return await self._get_collection('sensors')
+        data = await self.request('GET', self._url('sensors', sensor_id))
+        if isinstance(data, list):
+            logger.debug("Unable to read sensor with ID {0}: {1}".format(sensor_id, repr(data)))
+            return None
+        if parameter is None:
+            return data
+        return data[parameter]
+
+    async def create_sensor(self, name, modelid, swversion, sensor_type, uniqueid,
+                            manufacturername, state=None, config=None, recycle=False):
+        """ Returns (ID,None) of the new sensor or (None,message) if creation failed. """
+        data = {
+            "name": name,
+            "modelid": modelid,
+            "swversion": swversion,
+            "type": sensor_type,
+            "uniqueid": uniqueid,
+            "manufacturername": manufacturername,
+            "recycle": recycle
+        }
+        if state:
+            data["state"] = state
+        if config:
+            data["config"] = config
+        result = await self.request('POST', self._url('sensors', ''), data)
+        self._names.pop('sensors', None)
+        if "success" in result[0]:
+            return result[0]["success"]["id"], None
+        logger.debug("Failed to create sensor:" + repr(result[0]))
+        return None, result[0]
+
+    async def set_sensor(self, sensor_id, parameter, value=None):
+        data = parameter if isinstance(parameter, dict) else {parameter: value}
+        result = await self.request('PUT', self._url('sensors', sensor_id), data)
+        if 'error' in result[0]:
+            logger.warning("ERROR: {0} for sensor {1}".format(
+                result[0]['error']['description'], sensor_id))
+        elif 'name' in data:
+            self._names.pop('sensors', None)
+        return result
+
+    async def set_sensor_state(self, sensor_id, parameter, value=None):
+        return await self.set_sensor_content(sensor_id, parameter, value, "state")
+
+    async def set_sensor_config(self, sensor_id, parameter, value=None):
+        return await self.set_sensor_content(sensor_id, parameter, value, "config")
+
+    async def set_sensor_content(self, sensor_id, parameter, value=None, structure="state"):
+        """ Adjust the "state" or "config" structures of a sensor """
+        if structure != "state" and structure != "config":
+            logger.debug("set_sensor_current expects structure 'state' or 'config'.")
+            return False
+        data = parameter.copy() if isinstance(parameter, dict) else {parameter: value}
+        # Attempting to set this causes an error.
+        data.pop("lastupdated", None)
+        result = await self.request('PUT', self._url('sensors', sensor_id, structure), data)
+        if 'error' in result[0]:
+            logger.warning("ERROR: {0} for sensor {1}".format(
+                result[0]['error']['description'], sensor_id))
+        return result
+
+    async def delete_sensor(self, sensor_id):
+        self._names.pop('sensors', None)
+        return await self.request('DELETE', self._url('sensors', sensor_id))
+
+    # Scenes #####
+
+    async def get_scene(self):
+        return await self.request('GET', self._url('scenes'))
+
+    async def get_scenes(self):
+        return [Scene(k, **v) for k, v in (await self.get_scene()).items()]
+
+    async def activate_scene(self, group_id, scene_id):
+        return await self.request('PUT', self._url('groups', group_id, 'action'),
+                                  {"scene": scene_id})
+
+    async def run_scene(self, group_name, scene_name):
+        """Run a scene by group and scene name; see phue.Bridge.run_scene"""
+        all_groups, all_scenes = await asyncio.gather(self.get_group(), self.get_scenes())
+        groups = [(group_id, info) for group_id, info in all_groups.items()
+                  if info.get('name') == group_name]
+        scenes = [x for x in all_scenes if x.name == scene_name]
+        if len(groups) != 1:
+            logger.warning("run_scene: More than 1 group found by name %s", group_name)
+            return
+        group_id, group = groups[0]
+        if len(scenes) == 0:
+            logger.warning("run_scene: No scene found %s", scene_name)
+            return
+        if len(scenes) == 1:
+            await self.activate_scene(group_id, scenes[0].scene_id)
+            return
+        group_lights = sorted(int(x) for x in group.get('lights', ()))
+        for scene in scenes:
+            if group_lights == scene.lights:
+                await self.activate_scene(group_id, scene.scene_id)
+                return
+        logger.warning("run_scene: did not find a scene: %s that shared lights with group %s",
+                       scene_name, group_name)
+
+    # Schedules #####
+
+    async def get_schedule(self, schedule_id=None):
+        if schedule_id is None:
+            return await self.request('GET', self._url('schedules'))
+        return await self.request('GET', self._url('schedules', schedule_id))
+
+    async def create_schedule(self, name, time, light_id, data, description=' '):
+        return await self._create_schedule(name, time, self._url('lights', light_id, 'state'),
+                                           data, description)
+
+    async def create_group_schedule(self, name, time, group_id, data, description=' '):
+        return await self._create_schedule(name, time, self._url('groups', group_id, 'action'),
+                                           data, description)
+
+    async def _create_schedule(self, name, time, address, data, description):
+        schedule = {
+            'name': name,
+            'localtime': time,
+            'description': description,
+            'command': {'method': 'PUT', 'address': address, 'body': data},
+        }
+        return await self.request('POST', self._url('schedules'), schedule)
+
+    async def set_schedule_attributes(self, schedule_id, attributes):
+        return await self.request('PUT', self._url('schedules', schedule_id), attributes)
+
+    async def delete_schedule(self, schedule_id):
+        return await self.request('DELETE', self._url('schedules', schedule_id))
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# asyncio driver for the LEDENET Magic UFO LED WiFi Controller
+#
+# Speaks the same protocol as ts07.ufo over asyncio streams, so a single event loop can drive
+# many controllers without a thread per device. Requires Python 3.7+.
+
+import asyncio
+
+from .ufo import (API_PORT, OFF_FRAME, ON_FRAME, STATUS_LENGTH, STATUS_REQUEST,
+                  UfoConnectionError, _decode_status, _rgbw_frame)
+
+
+class AsyncUfo(object):
+    """A controller client that keeps one open connection and reconnects on demand.
+
+    Commands on the same instance are serialized; commands on different instances run
+    concurrently. Use ``gather`` to send one command to many controllers at once.
+
+        >>> async with AsyncUfo('10.0.1.111') as ufo:
+        ...     await ufo.rgbw(255, 0, 0, 0)
+        ...     await ufo.on()
+
+    """
+
+    def __init__(self, ip_address, hw_address=None, timeout=2.0):
+        self.ip_address = ip_address
+        self.hw_address = hw_address
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.ip_address)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def connected(self):
+        return (self._writer is not None and not self._writer.is_closing()
+                and not self._reader.at_eof())
+
+    async def _connect(self):
+        if not self.connected:
+            await self._disconnect()
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.ip_address, API_PORT), self.timeout)
+
+    async def _disconnect(self):
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def _send(self, data):
+        # Retry once over a fresh connection if the kept-open one turns out to be dead.
+        for attempt in (0, 1):
+            reused = self.connected
+            await self._connect()
+            try:
+                self._writer.write(data)
+                await asyncio.wait_for(self._writer.drain(), self.timeout)
+                return
+            except (ConnectionError, asyncio.TimeoutError):
+                await self._disconnect()
+                if not reused or attempt:
+                    raise
+
+    async def close(self):
+        async with self._lock:
+            await self._disconnect()
+
+    async def on(self):
+        async with self._lock:
+            await self._send(ON_FRAME)
+        return self
+
+    async def off(self):
+        async with self._lock:
+            await self._send(OFF_FRAME)
+        return self
+
+    async def rgbw(self, r, g, b, w):
+        async with self._lock:
+            await self._send(_rgbw_frame(r, g, b, w))
+        return self
+
+    async def status(self):
+        async with self._lock:
+            await self._send(STATUS_REQUEST)
+            try:
+                data = await asyncio.wait_for(self._reader.readexactly(STATUS_LENGTH),
+                                              self.timeout)
+            except asyncio.IncompleteReadError as e:
+                await self._disconnect()
+                raise UfoConnectionError("connection closed after %d of %d bytes"
+                                         % (len(e.partial), STATUS_LENGTH))
+            except BaseException:
+                await self._disconnect()
+                raise
+            return _decode_status(data)
+
+
+async def gather(ufos, command, *args, timeout=5.0):
+    """Run one command on many controllers concurrently, under a single deadline.
+
+    ``command`` names an AsyncUfo coroutine method ('on', 'off', 'rgbw' or 'status') and ``args``
+    are passed through to it. Returns a list in the same order as ``ufos``. Each entry is the
+    command's result, or the exception it raised. Controllers that have not finished when
+    ``timeout`` seconds elapse are cancelled and reported as ``asyncio.TimeoutError``.
+    """
+    tasks = [asyncio.ensure_future(getattr(ufo, command)(*args)) for ufo in ufos]
+    if not tasks:
+        return []
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.wait(pending)
+
+    results = []
+    for ufo, task in zip(ufos, tasks):
+        if task in pending:
+            results.append(asyncio.TimeoutError("%s did not answer %s within %ss"
+                                                % (ufo.ip_address, command, timeout)))
+        elif task.exception() is not None:
+            results.append(task.exception())
+        else:
+            results.append(task.result())
+    return results
@@ -1,19 +1,103 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import OrderedDict
+from concurrent.futures import TimeoutError
+from itertools import count
 from logging import getLogger
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-from .bottle import response, route, run, redirect
+import os
+from threading import Lock
+
+try:
+    from time import monotonic
+except ImportError:  # pragma: no cover
+    from time import time as monotonic
+
+from .bottle import HTTPError, request, response, route, run, redirect
+from . import fanout
+from .fanout import fan_out
+from .scenes import SceneRegistry
 from .ufo import Ufo
 from .phue import Bridge
 
 log = getLogger(__name__)
 
-hue_ip = '10.0.1.103'
-ufo_ceiling_1 = '10.0.1.111'
-ufo_under_bar = '10.0.1.112'
-ufo_under_cabinets = '10.0.1.113'
-ufo_back_bar_1 = '10.0.1.114'
+# devices and scenes; see ts07.scenes.SceneRegistry
+scenes_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scenes.json')
+
+# overall deadline, in seconds, for collecting status from every device
+status_timeout = 2.0
+# deadline, in seconds, for each device command sent by a button press
+command_timeout = 5.0
+# threads shared by all requests for talking to devices
+fanout_workers = 16
+# scene routes return before the devices are written; see apply_scene
+async_scenes = True
+# finished scene jobs kept for /jobs/<id>
+max_jobs = 100
+# seconds a snapshot of all Hue light states may be used to answer getters
+hue_state_ttl = 1.0
+
+_bridges = {}
+_bridges_lock = Lock()
+
+
+class Superseded(Exception):
+    """A scene command that was dropped because a newer scene was requested for its device."""
+
+
+class SceneDispatcher(object):
+    """Last writer wins: only the newest scene requested for a device is sent to it.
+
+    Every scene gets a generation number. A device's command runs only if its scene is still the
+    newest one sent to that device; older commands still queued are dropped with Superseded.
+    Commands for one device run one at a time, so a slow stale command can't land after a newer
+    one; a command that can't get its device before its deadline gives up with TimeoutError
+    rather than hold a fan-out thread.
+    """
+
+    def __init__(self):
+        self._generations = count(1)
+        self._latest = {}  # device key -> generation of the newest scene for it
+        self._device_locks = {}
+        self._lock = Lock()
+
+    def wrap(self, tasks, timeout):
+        """Return the scene's (key, fn, args[, timeout]) tasks guarded against newer scenes.
+
+        ``timeout`` is the deadline, in seconds from now, of tasks that don't carry their own.
+        """
+        tasks = tuple(tasks)
+        now = monotonic()
+        with self._lock:
+            generation = next(self._generations)
+            for task in tasks:
+                self._latest[task[0]] = generation
+                self._device_locks.setdefault(task[0], Lock())
+        return tuple((task[0], self._run,
+                      (task[0], generation, now + (task[3] if len(task) > 3 else timeout),
+                       task[1], task[2])) + task[3:]
+                     for task in tasks)
+
+    def _run(self, key, generation, deadline, fn, args):
+        # checked before waiting too, so a stale command doesn't queue behind the device lock
+        if self._latest[key] != generation:
+            raise Superseded("%s has a newer scene" % (key,))
+        lock = self._device_locks[key]
+        if not lock.acquire(timeout=max(0, deadline - monotonic())):
+            raise TimeoutError("%s was busy until the deadline" % (key,))
+        try:
+            if self._latest[key] != generation:
+                raise Superseded("%s has a newer scene" % (key,))
+            return fn(*args)
+        finally:
+            lock.release()
+
+
+scene_dispatcher = SceneDispatcher()
+
+_jobs = OrderedDict()
+_job_ids = count(1)
+_jobs_lock = Lock()
 
 # hue notes:
 #  hue has max 65536
@@ -21,167 +105,165 @@ ufo_back_bar_1 = '10.0.1.114'
 #  brightness has max 254
 
 
-def execute_tasks(tasks):
-    executor = ThreadPoolExecutor(10)
-    futures = (executor.submit(task[0], *task[1]) for task in tasks)
-    result = tuple(future.result() for future in as_completed(futures))
-    executor.shutdown(wait=True)
-
-
-@route('/set_red')
-def set_red():
-    b = Bridge(hue_ip)
-    def set_hue_red(light_id):
-        light = b.lights[light_id]
-        light.on = True
-        light.hue = 430
-        light.saturation = 252
-        light.brightness = 252
-
-    tasks = (
-        (lambda: Ufo(ufo_ceiling_1).rgbw(255, 0, 0, 0).on(), ()),
-        (lambda: Ufo(ufo_under_bar).rgbw(255, 0, 0, 0).on(), ()),
-        (lambda: Ufo(ufo_under_cabinets).rgbw(255, 0, 0, 0).on(), ()),
-        (lambda: Ufo(ufo_back_bar_1).rgbw(255, 0, 0, 0).on(), ()),
-        (set_hue_red, (0,)),
-        (set_hue_red, (1,)),
-    )
-    execute_tasks(tasks)
-    redirect("/")
-
-
-@route('/set_green')
-def set_green():
-    b = Bridge(hue_ip)
-    def set_hue_green(light_id):
-        light = b.lights[light_id]
-        light.on = True
-        light.hue = 25699
-        light.saturation = 254
-        light.brightness = 253
-
-    tasks = (
-        (lambda: Ufo(ufo_ceiling_1).rgbw(0, 255, 0, 0).on(), ()),
-        (lambda: Ufo(ufo_under_bar).rgbw(0, 255, 0, 0).on(), ()),
-        (lambda: Ufo(ufo_under_cabinets).rgbw(0, 255, 0, 0).on(), ()),
-        (lambda: Ufo(ufo_back_bar_1).rgbw(0, 255, 0, 0).on(), ()),
-        (set_hue_green, (0,)),
-        (set_hue_green, (1,)),
-    )
-    execute_tasks(tasks)
-    redirect("/")
-
-
-@route('/set_blue')
-def set_blue():
-    b = Bridge(hue_ip)
-    def set_hue_blue(light_id):
-        light = b.lights[light_id]
-        light.on = True
-        light.hue = 47112
-        light.saturation = 253
-        light.brightness = 252
-
-    tasks = (
-        (lambda: Ufo(ufo_ceiling_1).rgbw(0, 0, 80, 0).on(), ()),
-        (lambda: Ufo(ufo_under_bar).rgbw(0, 0, 128, 0).on(), ()),
-        (lambda: Ufo(ufo_under_cabinets).rgbw(0, 0, 255, 0).on(), ()),
-        (lambda: Ufo(ufo_back_bar_1).rgbw(0, 0, 255, 0).on(), ()),
-        (set_hue_blue, (0,)),
-        (set_hue_blue, (1,)),
-    )
-    execute_tasks(tasks)
-    redirect("/")
-
-
-@route('/set_light_blue')
-def set_light_blue():
-    b = Bridge(hue_ip)
-    def set_hue_blue(light_id):
-        light = b.lights[light_id]
-        light.on = True
-        light.hue = 42690
-        light.saturation = 216
-        light.brightness = 254
-
-    tasks = (
-        (lambda: Ufo(ufo_ceiling_1).rgbw(155, 155, 255, 0).on(), ()),
-        (lambda: Ufo(ufo_under_bar).rgbw(129, 129, 192, 0).on(), ()),
-        (lambda: Ufo(ufo_under_cabinets).rgbw(155, 155, 255, 0).on(), ()),
-        (lambda: Ufo(ufo_back_bar_1).rgbw(155, 155, 255, 0).on(), ()),
-        (set_hue_blue, (0,)),
-        (set_hue_blue, (1,)),
-    )
-    execute_tasks(tasks)
-    redirect("/")
-
-
-@route('/set_white')
-def set_white():
-    b = Bridge(hue_ip)
-    def set_hue_blue(light_id):
-        light = b.lights[light_id]
-        light.on = True
-        light.hue = 38373
-        light.saturation = 254
-        light.brightness = 254
-
-    tasks = (
-        (lambda: Ufo(ufo_ceiling_1).rgbw(0, 0, 0, 192).on(), ()),
-        (lambda: Ufo(ufo_under_bar).rgbw(0, 0, 0, 192).on(), ()),
-        (lambda: Ufo(ufo_under_cabinets).rgbw(255, 255, 255, 0).on(), ()),
-        (lambda: Ufo(ufo_back_bar_1).rgbw(255, 255, 255, 0).on(), ()),
-        (set_hue_blue, (0,)),
-        (set_hue_blue, (1,)),
-    )
-    execute_tasks(tasks)
+def get_bridge(ip):
+    """Return the process-wide Bridge for ip, creating it on first use.
+
+    Sharing one Bridge across requests keeps its light index, keep-alive connections and light
+    state snapshot warm. The config file is re-read only when it changes.
+    """
+    with _bridges_lock:
+        bridge = _bridges.get(ip)
+        if bridge is None:
+            bridge = _bridges[ip] = Bridge(ip, light_state_ttl=hue_state_ttl)
+    bridge.reload_config()
+    return bridge
+
+
+fanout.configure(fanout_workers)
+scenes = SceneRegistry(get_bridge).load(scenes_file)
+
+
+def execute_tasks(tasks, timeout=None):
+    """Run (key, fn, args) tasks on the shared fan-out engine and log how each one went.
+
+    Returns the Outcome of every task, in task order.
+    """
+    outcomes = fan_out(tasks, command_timeout if timeout is None else timeout)
+    for outcome in outcomes:
+        if outcome.error is None:
+            log.info("%s ok in %.0f ms", outcome.key, outcome.elapsed * 1000)
+        elif isinstance(outcome.error, Superseded):
+            log.info("%s skipped: %s", outcome.key, outcome.error)
+        else:
+            log.warning("%s failed after %.0f ms: %r", outcome.key, outcome.elapsed * 1000,
+                        outcome.error)
+    return outcomes
+
+
+def start_job(tasks, timeout=None):
+    """Start (key, fn, args) tasks in the background and register the job. Returns its id."""
+    job = fanout.engine.start(tasks, command_timeout if timeout is None else timeout)
+    with _jobs_lock:
+        job_id = next(_job_ids)
+        _jobs[job_id] = job
+        while len(_jobs) > max_jobs:
+            _jobs.popitem(last=False)
+    return job_id
+
+
+def apply_scene(tasks):
+    """Send a scene's tasks and answer the request.
+
+    A newer scene supersedes this one on any device it hasn't reached yet (see SceneDispatcher).
+
+    With ?job=1 the tasks are queued and the response is 202 with the job id; poll
+    /jobs/<id> for per-device results. Otherwise the browser is redirected home: at once
+    if async_scenes is set or ?wait=0, else after every device has answered.
+    """
+    tasks = scene_dispatcher.wrap(tasks, command_timeout)
+    if request.query.get('job') == '1':
+        job_id = start_job(tasks)
+        response.status = 202
+        response.set_header('Location', '/jobs/%d' % job_id)
+        return {'job': job_id, 'status': '/jobs/%d' % job_id}
+    if request.query.get('wait', '0' if async_scenes else '1') == '0':
+        start_job(tasks)
+    else:
+        execute_tasks(tasks)
     redirect("/")
 
 
-@route('/set_off')
-def set_off():
-    b = Bridge(hue_ip)
-    def set_hue_off(light_id):
-        light = b.lights[light_id]
-        light.on = False
-
-    tasks = (
-        (lambda: Ufo(ufo_ceiling_1).off(), ()),
-        (lambda: Ufo(ufo_under_bar).off(), ()),
-        (lambda: Ufo(ufo_under_cabinets).off(), ()),
-        (lambda: Ufo(ufo_back_bar_1).off(), ()),
-        (set_hue_off, (0,)),
-        (set_hue_off, (1,)),
-    )
-    execute_tasks(tasks)
-    redirect("/")
+def describe_outcome(key, outcome):
+    if outcome is None:
+        return {'device': key, 'state': 'running'}
+    described = {'device': key, 'elapsed_ms': int(round(outcome.elapsed * 1000))}
+    if outcome.error is None:
+        described['state'] = 'ok'
+    elif isinstance(outcome.error, Superseded):
+        described['state'] = 'superseded'
+    else:
+        described['state'] = 'failed'
+        described['error'] = repr(outcome.error)
+    return described
+
+
+@route('/jobs/<job_id:int>')
+def get_job(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        raise HTTPError(404, 'No such job: %d' % job_id)
+    return {
+        'job': job_id,
+        'done': job.done,
+        'devices': [describe_outcome(str(key), outcome)
+                    for key, outcome in zip(job.keys, job.outcomes())],
+    }
+
+
+@route('/scene/<name>')
+@route('/set_<name>')
+def set_scene(name):
+    if name not in scenes:
+        raise HTTPError(404, 'No such scene: %s' % name)
+    return apply_scene(scenes[name].tasks)
+
+
+def describe_hue_status(name, state, error=None, elapsed=None):
+    builder = []
+    builder.append("hue light: %s" % name)
+    if error is not None:
+        builder.append("  error: %s" % (str(error) or type(error).__name__))
+    else:
+        builder.append("  power: %s" % ("on" if state['on'] else "off"))
+        builder.append("  hue: %s" % state['hue'])
+        builder.append("  saturation: %s" % state['sat'])
+        builder.append("  brightness: %s" % state['bri'])
+    if elapsed is not None:
+        builder.append("  elapsed: %.0f ms" % (elapsed * 1000))
+    return '\n'.join(builder)
 
 
 @route('/get_status')
 def get_status():
-    b = Bridge(hue_ip)
-    def get_hue_status(light_id):
-        light = b.lights[light_id]
-        builder = []
-        builder.append("hue id: %s" % light_id)
-        builder.append("  power: %s" % ("on" if light.on else "off"))
-        builder.append("  hue: %s" % light.hue)
-        builder.append("  saturation: %s" % light.saturation)
-        builder.append("  brightness: %s" % light.brightness)
-        builder.append("")
-        return '\n'.join(builder)
-
-    result = Ufo.all_status()
-    result += get_hue_status(0)
-    result += get_hue_status(1)
+    def get_hue_status(name):
+        # the bridge is looked up inside the fan-out so a bad config or unreachable bridge is
+        # reported per light instead of failing the whole page
+        light = scenes.hue_light(name)
+        return {
+            'on': light.on,
+            'hue': light.hue,
+            'sat': light.saturation,
+            'bri': light.brightness,
+        }
+
+    calls = [(ufo, ufo.get_status, (status_timeout,)) for ufo in Ufo.discover_all()]
+    calls.extend((name, get_hue_status, (name,)) for name in scenes.hue_lights)
+
+    builder = []
+    for outcome in fan_out(calls, status_timeout):
+        if isinstance(outcome.key, Ufo):
+            builder.append(outcome.key.describe(outcome.value, outcome.error, outcome.elapsed))
+        else:
+            builder.append(describe_hue_status(*outcome))
+        builder.append('')
     response.content_type = 'text/plain'
-    return result
+    return '\n'.join(builder)
 
 
 @route('/')
 def index():
     response.content_type = 'text/html; charset=latin9'
-    return index_html
+    return render_index()
+
+
+def render_index():
+    buttons = []
+    for scene in scenes:
+        style = ' style="%s"' % scene.style if scene.style else ''
+        buttons.append('  <a href="/scene/%s" class="%s"%s>%s</a>' % (
+            scene.name, scene.button_class, style, scene.label))
+    return index_html % '\n'.join(buttons)
 
 
 index_html = """<!DOCTYPE html>
@@ -194,12 +276,7 @@ index_html = """<!DOCTYPE html>
   <body>
 
 <div class="container-fluid">
-  <a href="/set_off" class="btn btn-outline-primary btn-lg btn-block">Off</a>
-  <a href="/set_white" class="btn btn-primary btn-lg btn-block" style="background-color: #fff; color: #000;">White</a>
-  <a href="/set_blue" class="btn btn-primary btn-lg btn-block" style="background-color: #00f;">Blue</a>
-  <a href="/set_green" class="btn btn-primary btn-lg btn-block btn-success">Green</a>
-  <a href="/set_light_blue" class="btn btn-primary btn-lg btn-block btn-info">Light Blue</a>
-  <a href="/set_red" class="btn btn-primary btn-lg btn-block btn-danger">Red</a>
+%s
 </div>
 
   </body>
@@ -208,4 +285,22 @@ index_html = """<!DOCTYPE html>
 
 
 if __name__ == "__main__":
-    run(host='0.0.0.0', port=3607)
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m ts07.app')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=3607)
+    parser.add_argument('--server', default='threaded',
+                        help="bottle server adapter; 'threaded' serves requests concurrently, "
+                             "'wsgiref' one at a time")
+    parser.add_argument('--threads', type=int, default=16,
+                        help="connections served at once by the 'threaded' server")
+    parser.add_argument('--scenes', default=scenes_file, help="scene config file (JSON)")
+    args = parser.parse_args()
+
+    if args.scenes != scenes_file:
+        scenes.load(args.scenes)
+
+    Ufo.registry.start()
+    options = dict(threads=args.threads) if args.server == 'threaded' else {}
+    run(host=args.host, port=args.port, server=args.server, **options)
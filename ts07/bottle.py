@@ -2784,6 +2784,203 @@ class WSGIRefServer(ServerAdapter):
         srv.serve_forever()
 
 
+class ThreadedWSGIRefServer(ServerAdapter):
+    """ wsgiref with a bounded thread pool and HTTP/1.1 keep-alive. Stdlib,
+        Python 3 only.
+
+        Options: ``threads`` (default 16) requests are served at once. A
+        connection only takes a thread while a request on it is readable:
+        idle keep-alive connections wait in a selector and are closed after
+        ``keepalive_timeout`` (default 15) seconds. A request that has begun
+        must arrive in full within ``request_timeout`` (default 10) seconds. """
+    def run(self, app): # pragma: no cover
+        from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, ServerHandler
+        from concurrent.futures import ThreadPoolExecutor
+        import selectors, socket
+
+        quiet = self.quiet
+        threads = self.options.get('threads', 16)
+        keepalive_timeout = self.options.get('keepalive_timeout', 15)
+        request_timeout = self.options.get('request_timeout', 10)
+        monotonic = time.monotonic
+
+        class KeepAliveServerHandler(ServerHandler):
+            http_version = '1.1'
+            def cleanup_headers(self):
+                ServerHandler.cleanup_headers(self)
+                # Without a length the client can only find the end by EOF.
+                if 'Content-Length' not in self.headers:
+                    self.request_handler.close_connection = True
+                if self.request_handler.close_connection:
+                    self.headers['Connection'] = 'close'
+
+        class KeepAliveHandler(WSGIRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            timeout = request_timeout
+            def address_string(self): # Prevent reverse DNS lookups please.
+                return self.client_address[0]
+            def log_request(*args, **kw):
+                if not quiet:
+                    return WSGIRequestHandler.log_request(*args, **kw)
+            def handle_one_request(self):
+                self.close_connection = True
+                try:
+                    self.raw_requestline = self.rfile.readline(65537)
+                except (socket.timeout, socket.error):
+                    return
+                if not self.raw_requestline:
+                    return
+                if len(self.raw_requestline) > 65536:
+                    self.requestline = self.request_version = self.command = ''
+                    self.send_error(414)
+                    return
+                if not self.parse_request():
+                    return
+                # An unread request body would be parsed as the next request.
+                if self.headers.get('Content-Length', '0') != '0' \
+                        or 'Transfer-Encoding' in self.headers:
+                    self.close_connection = True
+                handler = KeepAliveServerHandler(
+                    self.rfile, self.wfile, self.get_stderr(), self.get_environ(),
+                    multithread=True)
+                handler.request_handler = self
+                handler.run(self.server.get_app())
+                self.wfile.flush()
+
+        class Connection(object):
+            # One client socket and the request handler reading it. Served by
+            # one pool thread at a time, and parked in between requests.
+            def __init__(self, server, sock, client_address):
+                self.server = server
+                self.sock = sock
+                self.parked = None
+                # Headers and body go out in separate writes; without this the
+                # body waits on the client's delayed ACK for every reply after
+                # the first one on a connection.
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                handler = self.handler = KeepAliveHandler.__new__(KeepAliveHandler)
+                handler.request = sock
+                handler.client_address = client_address
+                handler.server = server
+                handler.setup()
+
+            def serve(self):
+                handler = self.handler
+                try:
+                    handler.handle_one_request()
+                    # pipelined requests already in the buffer are served now
+                    while not handler.close_connection and self.buffered():
+                        handler.handle_one_request()
+                except Exception:
+                    self.server.handle_error(self.sock, handler.client_address)
+                    handler.close_connection = True
+                if handler.close_connection:
+                    self.close()
+                else:
+                    self.server.parking.park(self)
+
+            def buffered(self):
+                # Is the next request already read into rfile or waiting on the
+                # socket? Never blocks.
+                self.sock.setblocking(False)
+                try:
+                    return bool(self.handler.rfile.peek(1))
+                except (socket.error, ValueError):
+                    return False
+                finally:
+                    self.sock.settimeout(request_timeout)
+
+            def close(self):
+                try:
+                    self.handler.finish()
+                except Exception:
+                    pass
+                self.server.shutdown_request(self.sock)
+
+        class Parking(object):
+            # Watches idle connections on a selector thread and hands one to the
+            # pool when its next request becomes readable.
+            def __init__(self, server):
+                self.server = server
+                self.selector = selectors.DefaultSelector()
+                self.incoming = []
+                self.lock = threading.Lock()
+                self.closed = False
+                self.wake_r, self.wake_w = socket.socketpair()
+                self.wake_r.setblocking(False)
+                self.selector.register(self.wake_r, selectors.EVENT_READ)
+                thread = threading.Thread(target=self.run, name='bottle-keepalive')
+                thread.daemon = True
+                thread.start()
+
+            def park(self, connection):
+                connection.parked = monotonic()
+                with self.lock:
+                    self.incoming.append(connection)
+                self.wake()
+
+            def wake(self):
+                try:
+                    self.wake_w.send(b'x')
+                except socket.error:
+                    pass
+
+            def run(self):
+                while not self.closed:
+                    for key, _ in self.selector.select(1.0):
+                        if key.fileobj is self.wake_r:
+                            try:
+                                self.wake_r.recv(4096)
+                            except socket.error:
+                                pass
+                            continue
+                        self.selector.unregister(key.fileobj)
+                        self.server.pool.submit(key.data.serve)
+                    with self.lock:
+                        incoming, self.incoming = self.incoming, []
+                    for connection in incoming:
+                        self.selector.register(connection.sock, selectors.EVENT_READ, connection)
+                    now = monotonic()
+                    for key in list(self.selector.get_map().values()):
+                        if key.data is not None and now - key.data.parked > keepalive_timeout:
+                            self.selector.unregister(key.fileobj)
+                            key.data.close()
+                for key in list(self.selector.get_map().values()):
+                    if key.data is not None:
+                        key.data.close()
+                self.selector.close()
+
+            def close(self):
+                self.closed = True
+                self.wake()
+
+        class PooledWSGIServer(WSGIServer):
+            def __init__(self, *a, **ka):
+                WSGIServer.__init__(self, *a, **ka)
+                self.pool = ThreadPoolExecutor(threads)
+                self.parking = Parking(self)
+            def process_request(self, request, client_address):
+                # A new connection waits for its first request like an idle one.
+                self.parking.park(Connection(self, request, client_address))
+            def server_close(self):
+                WSGIServer.server_close(self)
+                self.parking.close()
+                self.pool.shutdown(wait=False)
+
+        server_cls = self.options.get('server_class', PooledWSGIServer)
+        if ':' in self.host: # Fix wsgiref for IPv6 addresses.
+            if getattr(server_cls, 'address_family') == socket.AF_INET:
+                class server_cls(server_cls):
+                    address_family = socket.AF_INET6
+
+        srv = server_cls((self.host, self.port), KeepAliveHandler)
+        srv.set_app(app)
+        try:
+            srv.serve_forever()
+        finally:
+            srv.server_close()
+
+
 class CherryPyServer(ServerAdapter):
     def run(self, handler): # pragma: no cover
         from cherrypy import wsgiserver
@@ -2986,6 +3183,7 @@ server_names = {
     'cgi': CGIServer,
     'flup': FlupFCGIServer,
     'wsgiref': WSGIRefServer,
+    'threaded': ThreadedWSGIRefServer,
     'waitress': WaitressServer,
     'cherrypy': CherryPyServer,
     'paste': PasteServer,
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#
+# Emulator for the LEDENET Magic UFO LED WiFi Controller
+#
+# Runs any number of virtual controllers in one asyncio event loop, so ts07.ufo and
+# ts07.aioufo can be exercised and benchmarked without hardware. Each virtual controller
+# listens for TCP commands on API_PORT at its own loopback address (on Linux, all of
+# 127.0.0.0/8 routes to loopback), and a single UDP responder answers discovery for all of them.
+#
+#     $ python -m ts07.emulator --count 200 --latency 0.005 --jitter 0.002 --loss 0.01
+#
+#     >>> from ts07.emulator import Emulator
+#     >>> from ts07.ufo import Ufo
+#     >>> emulator = Emulator(count=20).start()
+#     >>> Ufo.discovery_address = emulator.discovery_host
+#     >>> Ufo.discover_all()
+#
+# Requires Python 3.7+.
+
+import argparse
+import asyncio
+import ipaddress
+import logging
+import random
+import threading
+
+from .ufo import (API_PORT, DISCOVERY_MESSAGE, DISCOVERY_PORT, OFF_FRAME, ON_FRAME,
+                  STATUS_REQUEST, _frame)
+
+log = logging.getLogger(__name__)
+
+# payload length (including checksum) of each command the controllers understand, by packet id
+FRAME_LENGTHS = {
+    0x31: 8,  # set color: 0x31 r g b w 0x00 0x0F checksum
+    0x71: 4,  # set power: 0x71 0x23|0x24 0x0F checksum
+    0x81: 4,  # status request: 0x81 0x8A 0x8B 0x96
+}
+
+
+class VirtualUfo(object):
+    """State and simulated network behavior of one emulated controller."""
+
+    def __init__(self, ip_address, hw_address, latency=0.0, jitter=0.0, loss=0.0):
+        self.ip_address = ip_address
+        self.hw_address = hw_address
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.power = False
+        self.rgbw = (0, 0, 0, 0)
+        self.commands = 0
+
+    def __repr__(self):
+        return '<%s %s %s>' % (self.__class__.__name__, self.ip_address, self.hw_address)
+
+    async def delay(self):
+        """Wait out this device's latency. Returns False if the packet should be dropped."""
+        if self.loss and random.random() < self.loss:
+            return False
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return True
+
+    def status_frame(self):
+        return _frame(0x81, 0x44, 0x23 if self.power else 0x24, 0x61, 0x21, 0x10,
+                      self.rgbw[0], self.rgbw[1], self.rgbw[2], self.rgbw[3], 0x03, 0x00, 0x00)
+
+    def handle(self, frame):
+        """Apply one complete command frame. Returns the bytes to reply with, if any."""
+        self.commands += 1
+        if frame == STATUS_REQUEST:
+            return self.status_frame()
+        if sum(frame[:-1]) % 0x100 != frame[-1]:
+            log.debug("%s dropped frame with bad checksum: %r", self.ip_address, frame)
+        elif frame == ON_FRAME:
+            self.power = True
+        elif frame == OFF_FRAME:
+            self.power = False
+        elif frame[0] == 0x31:
+            self.rgbw = tuple(frame[1:5])
+        return None
+
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                packet_id = await reader.readexactly(1)
+                length = FRAME_LENGTHS.get(packet_id[0])
+                if length is None:
+                    log.debug("%s got unknown packet id 0x%02x; closing", self.ip_address,
+                              packet_id[0])
+                    break
+                frame = packet_id + await reader.readexactly(length - 1)
+                if not await self.delay():
+                    continue
+                reply = self.handle(frame)
+                if reply is not None:
+                    writer.write(reply)
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class _DiscoveryProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, devices):
+        self.devices = devices
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if data == DISCOVERY_MESSAGE:
+            for device in self.devices:
+                asyncio.ensure_future(self._reply(device, addr))
+
+    async def _reply(self, device, addr):
+        if await device.delay():
+            reply = '%s,%s,HF-LPB100-ZJ200' % (device.ip_address, device.hw_address)
+            self.transport.sendto(reply.encode('utf-8'), addr)
+
+
+class Emulator(object):
+    """A fleet of virtual controllers on consecutive loopback addresses.
+
+    ``latency`` and ``jitter`` are in seconds and apply to every command and discovery reply;
+    ``loss`` is the probability that any one of them is silently dropped.
+
+    """
+
+    def __init__(self, count=4, first_address='127.0.1.1', discovery_host='127.0.0.1',
+                 latency=0.0, jitter=0.0, loss=0.0):
+        first = ipaddress.ip_address(first_address)
+        self.devices = [
+            VirtualUfo(str(first + i), 'ACCF23%06X' % i, latency, jitter, loss)
+            for i in range(count)
+        ]
+        self.discovery_host = discovery_host
+        self._servers = []
+        self._connections = set()
+        self._transport = None
+        self._loop = None
+        self._thread = None
+
+    async def serve(self):
+        """Bind every virtual controller and the discovery responder on the running loop."""
+        for device in self.devices:
+            self._servers.append(await asyncio.start_server(
+                self._tracked(device.serve_connection), device.ip_address, API_PORT))
+        self._transport, _ = await asyncio.get_event_loop().create_datagram_endpoint(
+            lambda: _DiscoveryProtocol(self.devices),
+            local_addr=(self.discovery_host, DISCOVERY_PORT))
+        log.info("emulating %d controllers from %s", len(self.devices),
+                 self.devices[0].ip_address if self.devices else None)
+
+    def _tracked(self, serve_connection):
+        # Remember each open connection so close() can tear it down.
+        async def handle(reader, writer):
+            task = asyncio.current_task()
+            self._connections.add(task)
+            try:
+                await serve_connection(reader, writer)
+            except asyncio.CancelledError:
+                pass  # the emulator is shutting down
+            finally:
+                self._connections.discard(task)
+        return handle
+
+    async def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        for server in self._servers:
+            server.close()
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        for server in self._servers:
+            await server.wait_closed()
+        del self._servers[:]
+
+    def start(self):
+        """Run the emulator on its own event loop in a daemon thread. Returns self."""
+        started = threading.Event()
+        failure = []
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._loop.run_until_complete(self.serve())
+            except Exception as e:
+                failure.append(e)
+                started.set()
+                return
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.close())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name='ufo-emulator')
+        self._thread.daemon = True
+        self._thread.start()
+        started.wait()
+        if failure:
+            raise failure[0]
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulate LEDENET Magic UFO controllers.")
+    parser.add_argument('--count', type=int, default=4, help="number of virtual controllers")
+    parser.add_argument('--first-address', default='127.0.1.1',
+                        help="address of the first controller; the rest follow consecutively")
+    parser.add_argument('--discovery-host', default='127.0.0.1',
+                        help="address to answer UDP discovery on")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds per command")
+    parser.add_argument('--jitter', type=float, default=0.0, help="+/- seconds of latency")
+    parser.add_argument('--loss', type=float, default=0.0,
+                        help="probability [0-1] that a packet is dropped")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    emulator = Emulator(args.count, args.first_address, args.discovery_host,
+                        args.latency, args.jitter, args.loss)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(emulator.serve())
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(emulator.close())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
+from logging import getLogger
+from threading import Lock, local
+
+try:
+    from time import monotonic
+except ImportError:  # pragma: no cover
+    from time import time as monotonic
+
+log = getLogger(__name__)
+
+# key: whatever the caller used to identify the call (a device, a light id, ...)
+# value: the call's return value, or None if it failed
+# error: the exception the call raised, a TimeoutError if it missed the deadline, or None
+# elapsed: seconds the call took, or the full timeout if it missed the deadline
+Outcome = namedtuple('Outcome', ('key', 'value', 'error', 'elapsed'))
+
+# the deadline of the call running on this thread; see remaining()
+_current = local()
+
+
+def remaining():
+    """Seconds left before the deadline of the fan-out call running on this thread.
+
+    None outside a fan-out call. Lets a call bound its own blocking waits by its deadline.
+    """
+    deadline = getattr(_current, 'deadline', None)
+    return None if deadline is None else max(0.0, deadline - monotonic())
+
+
+def _timed(key, fn, args, deadline):
+    start = monotonic()
+    if start > deadline:
+        # queued behind other work until its deadline passed; too late to be worth running
+        return None, TimeoutError("%s was not started before its deadline" % (key,)), 0.0
+    _current.deadline = deadline
+    try:
+        return fn(*args), None, monotonic() - start
+    except Exception as e:
+        return None, e, monotonic() - start
+    finally:
+        _current.deadline = None
+
+
+class FanOut(object):
+    """A long-lived pool of at most ``max_workers`` threads for concurrent device calls.
+
+    One FanOut is shared by the whole process, so threads are started once and overlapping
+    callers together never run more than ``max_workers`` calls at a time.
+    """
+
+    def __init__(self, max_workers=16):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers)
+            return self._executor
+
+    def start(self, calls, timeout):
+        """Start (key, fn, args) or (key, fn, args, timeout) calls and return a Job at once.
+
+        Each call has its own deadline: its fourth element if given, else ``timeout`` seconds from
+        now. See Job for reading the results.
+        """
+        return Job(self.executor, tuple(calls), timeout)
+
+    def run(self, calls, timeout):
+        """Run calls as FanOut.start does, and wait for every one to finish or miss its deadline.
+
+        Returns a tuple of Outcome in the same order as ``calls``. Every call gets an Outcome,
+        so a slow or dead device shows up as an error instead of delaying or failing the rest.
+        Calls still running at their deadline are reported as timed out and left to finish in the
+        background; calls that had not started by then are not run at all.
+        """
+        job = self.start(calls, timeout)
+        job.wait()
+        outcomes = job.outcomes()
+        for outcome in outcomes:
+            if outcome.error is not None:
+                log.debug("%s failed after %.3fs: %r", outcome.key, outcome.elapsed, outcome.error)
+        return outcomes
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+class Job(object):
+    """Calls running in the background on a FanOut; see FanOut.start.
+
+    Nothing waits on a Job: outcomes() reports whatever has happened by the time it is called.
+    """
+
+    def __init__(self, executor, calls, timeout):
+        self.started = monotonic()
+        self.keys = tuple(call[0] for call in calls)
+        self.timeouts = tuple(call[3] if len(call) > 3 else timeout for call in calls)
+        self._futures = tuple(
+            executor.submit(_timed, call[0], call[1], call[2], self.started + call_timeout)
+            for call, call_timeout in zip(calls, self.timeouts))
+
+    @property
+    def done(self):
+        """True once every call has finished or missed its deadline"""
+        now = monotonic()
+        return all(future.done() or now > self.started + call_timeout
+                   for future, call_timeout in zip(self._futures, self.timeouts))
+
+    def wait(self):
+        """Block until the job is done; calls past their deadline are cancelled if not started"""
+        for future, call_timeout in zip(self._futures, self.timeouts):
+            wait([future], timeout=max(0, self.started + call_timeout - monotonic()))
+            if not future.done():
+                future.cancel()
+
+    def outcomes(self):
+        """An Outcome per call, in call order; None for a call still inside its deadline"""
+        now = monotonic()
+        outcomes = []
+        for key, future, call_timeout in zip(self.keys, self._futures, self.timeouts):
+            if future.done() and not future.cancelled():
+                outcomes.append(Outcome(key, *future.result()))
+            elif now > self.started + call_timeout or future.cancelled():
+                error = TimeoutError("%s did not finish within %ss" % (key, call_timeout))
+                outcomes.append(Outcome(key, None, error, call_timeout))
+            else:
+                outcomes.append(None)
+        return tuple(outcomes)
+
+
+# the process-wide engine behind fan_out
+engine = FanOut()
+
+
+def configure(max_workers):
+    """Replace the shared engine with one of ``max_workers`` threads.
+
+    Calls already running on the old engine finish there.
+    """
+    global engine
+    old, engine = engine, FanOut(max_workers)
+    old.shutdown(wait=False)
+
+
+def fan_out(calls, timeout):
+    """Run (key, fn, args) calls concurrently under one overall deadline on the shared engine.
+
+    See FanOut.run.
+    """
+    return engine.run(calls, timeout)
@@ -16,10 +16,16 @@ I am in no way affiliated with the Philips organization.
 '''
 import json
 import logging
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 import os
 import platform
 import sys
 import socket
+import threading
+import time
+import zlib
 if sys.version_info[0] > 2:
     PY3K = True
 else:
@@ -27,11 +33,25 @@ else:
 
 if PY3K:
     import http.client as httplib
+    import queue
 else:
     import httplib
+    import Queue as queue
 
 logger = logging.getLogger('phue')
 
+monotonic = getattr(time, 'monotonic', time.time)
+
+# rate limit tokens taken by one group command; the bridge takes about one per second
+GROUP_COMMAND_COST = 10
+
+# name prefix of the groups group_fanout='create' makes; group names are limited to 32 characters
+FANOUT_GROUP_PREFIX = 'phue-fanout-'
+
+# methods safe to resend when a kept-open connection dies mid-request; a POST that reached
+# the bridge before the reset has already created its group, scene, schedule or rule
+RETRY_METHODS = frozenset(('GET', 'PUT', 'DELETE'))
+
 
 if platform.system() == 'Windows':
     USER_HOME = 'USERPROFILE'
@@ -49,6 +69,16 @@ def is_string(data):
         return isinstance(data, str) or isinstance(data, unicode)  # noqa
 
 
+def default_config_file_path():
+    """Where the bridge ip and username are saved when no config_file_path is given."""
+    if os.getenv(USER_HOME) is not None and os.access(os.getenv(USER_HOME), os.W_OK):
+        return os.path.join(os.getenv(USER_HOME), '.python_hue')
+    elif 'iPad' in platform.machine() or 'iPhone' in platform.machine() or 'iPad' in platform.machine():
+        return os.path.join(os.getenv(USER_HOME), 'Documents', '.python_hue')
+    else:
+        return os.path.join(os.getcwd(), '.python_hue')
+
+
 class PhueException(Exception):
 
     def __init__(self, id, message):
@@ -64,6 +94,257 @@ class PhueRequestTimeout(PhueException):
     pass
 
 
+class ConnectionPool(object):
+
+    """ Thread-safe pool of persistent (keep-alive) HTTP connections to one bridge
+
+    At most `size` connections are open at once; further callers wait for one to be
+    returned. Connections are reused most-recently-returned first, so that a burst of
+    requests rides the warmest connection.
+
+    """
+    def __init__(self, host, size=4, timeout=10):
+        self.host = host
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self, fresh=False):
+        """ Check out a connection. Returns (connection, reused).
+
+        With fresh, a new connection is opened even if an idle one is available.
+        """
+        self._slots.acquire()
+        if fresh:
+            return httplib.HTTPConnection(self.host, timeout=self.timeout), False
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return httplib.HTTPConnection(self.host, timeout=self.timeout), False
+
+    def release(self, connection):
+        """ Return a connection whose response has been read in full. """
+        self._idle.put(connection)
+        self._slots.release()
+
+    def discard(self, connection):
+        """ Close a connection that failed, or that the bridge asked to close. """
+        connection.close()
+        self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class NameIndex(object):
+
+    """ Name to id lookups for one kind of bridge resource
+
+    `resource` is 'lights', 'groups', 'sensors' or 'scenes'. The index is built
+    from one GET of the whole collection and reused until it is `ttl` seconds
+    old (forever if ttl is None) or invalidated. A name that isn't found
+    triggers one rebuild, in case the resource was added or renamed elsewhere.
+    The collection itself is kept too, for callers that need more than ids.
+
+    """
+    def __init__(self, bridge, resource, ttl=None):
+        self.bridge = bridge
+        self.resource = resource
+        self.ttl = ttl
+        self._ids = None
+        self._collection = None
+        self._built = None
+        self._lock = threading.Lock()
+
+    def update(self, collection):
+        """ Rebuild the index from a collection already fetched from the bridge """
+        if not isinstance(collection, dict):
+            return
+        ids = dict((info['name'], resource_id) for resource_id, info in collection.items()
+                   if isinstance(info, dict) and 'name' in info)
+        with self._lock:
+            self._ids = ids
+            self._collection = collection
+            self._built = monotonic()
+
+    def refresh(self):
+        self.update(self.bridge.request(
+            'GET', '/api/' + self.bridge.username + '/' + self.resource + '/'))
+
+    def invalidate(self):
+        with self._lock:
+            self._ids = None
+
+    def rename(self, resource_id, name):
+        """ Record that resource_id is now called name """
+        with self._lock:
+            if self._ids is None:
+                return
+            resource_id = str(resource_id)
+            for old_name, old_id in list(self._ids.items()):
+                if old_id == resource_id:
+                    del self._ids[old_name]
+            self._ids[name] = resource_id
+            if isinstance(self._collection.get(resource_id), dict):
+                self._collection[resource_id]['name'] = name
+
+    def _fresh(self):
+        # called with the lock held
+        if self._ids is None:
+            return False
+        return self.ttl is None or monotonic() - self._built <= self.ttl
+
+    def _get(self, name):
+        with self._lock:
+            if not self._fresh():
+                return None
+            return self._ids.get(name)
+
+    def collection(self):
+        """ The whole collection, from the last GET if that is fresh enough """
+        with self._lock:
+            if self._fresh():
+                return self._collection
+        self.refresh()
+        with self._lock:
+            return self._collection or {}
+
+    def lookup(self, name):
+        """ The id (a string) for name, or False if there is none. Case-sensitive. """
+        if not PY3K and isinstance(name, str):
+            name = name.decode('utf-8')
+        resource_id = self._get(name)
+        if resource_id is None:
+            self.refresh()
+            resource_id = self._get(name)
+        return False if resource_id is None else resource_id
+
+
+class TokenBucket(object):
+
+    """ Rate limiter for the commands sent to one bridge
+
+    Every command path of a Bridge (set_light and set_group dispatch, and the
+    CommandScheduler) takes its tokens from the bridge's one bucket. Tokens
+    refill at `rate` per second, up to `burst`. acquire(cost) waits until
+    `cost` tokens are available and takes them; try_acquire(cost) doesn't wait.
+
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self._tokens = self.burst
+        self._refilled = monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, cost=1):
+        """ Take `cost` tokens if they are available and return 0, else return
+        the seconds until they will be """
+        # let a command through even if burst is smaller than its cost
+        cost = min(cost, self.burst)
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+            if self._tokens >= cost:
+                self._tokens -= cost
+                return 0
+            return (cost - self._tokens) / self.rate
+
+    def acquire(self, cost=1):
+        while True:
+            delay = self.try_acquire(cost)
+            if not delay:
+                return
+            time.sleep(delay)
+
+
+class CommandScheduler(object):
+
+    """ Paces light and group commands to a rate the bridge can take
+
+    The bridge handles about 10 light commands per second and about one group
+    command per second; beyond that, commands are dropped or queued on the
+    bridge. Commands submitted here are sent from a worker thread, paced by
+    the bridge's rate_limit, which every other command path shares. A group
+    command costs `group_cost` tokens.
+
+    While a command waits in the queue, newer commands for the same light or
+    group are merged into it, with later values winning, so a burst of UI input
+    becomes the smallest set of commands. Every submit returns a Future that
+    resolves to the bridge's response for the command that carried it.
+
+    """
+    def __init__(self, bridge, group_cost=GROUP_COMMAND_COST):
+        self.bridge = bridge
+        self.group_cost = group_cost
+        self._pending = OrderedDict()  # ('light'|'group', id) -> (data, [futures])
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def submit(self, kind, target_id, data):
+        """ Queue a state change for a 'light' or 'group'; returns a Future """
+        future = Future()
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError('CommandScheduler is shut down')
+            key = (kind, target_id)
+            if key in self._pending:
+                self._pending[key][0].update(data)
+                self._pending[key][1].append(future)
+                logger.debug("Coalesced {0} into pending command for {1} {2}".format(
+                    data, kind, target_id))
+            else:
+                self._pending[key] = (dict(data), [future])
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='phue-scheduler')
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped and not self._pending:
+                    return
+                (kind, target_id), _ = next(iter(self._pending.items()))
+            # wait for tokens without the lock, so newer commands keep merging in
+            self.bridge.rate_limit.acquire(self.group_cost if kind == 'group' else 1)
+            with self._condition:
+                data, futures = self._pending.pop((kind, target_id))
+            self._send(kind, target_id, data, futures)
+
+    def _send(self, kind, target_id, data, futures):
+        try:
+            if kind == 'group':
+                result = self.bridge.set_group(target_id, data)
+            else:
+                result = self.bridge.set_light(target_id, data)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+        else:
+            for future in futures:
+                future.set_result(result)
+
+    def shutdown(self, wait=True):
+        """ Stop accepting commands; queued commands are still sent """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+
 class Light(object):
 
     """ Hue Light object
@@ -89,6 +370,9 @@ class Light(object):
         self._reset_bri_after_on = None
         self._reachable = None
         self._type = None
+        # Light objects are shared (Bridge.lights, get_light_objects), so a batch() belongs to
+        # the thread that opened it
+        self._local = threading.local()
 
     def __repr__(self):
         # like default python repr function, but add light name
@@ -104,17 +388,107 @@ class Light(object):
         return self.bridge.get_light(self.light_id, *args, **kwargs)
 
     def _set(self, *args, **kwargs):
+        if self._add_to_batch(*args, **kwargs):
+            return
 
         if self.transitiontime is not None:
-            kwargs['transitiontime'] = self.transitiontime
+            kwargs.setdefault('transitiontime', self.transitiontime)
             logger.debug("Setting with transitiontime = {0} ds = {1} s".format(
-                self.transitiontime, float(self.transitiontime) / 10))
+                kwargs['transitiontime'], float(kwargs['transitiontime']) / 10))
 
             if (args[0] == 'on' and args[1] is False) or (
-                    kwargs.get('on', True) is False):
+                    kwargs.get('on', True) is False) or (
+                    isinstance(args[0], dict) and args[0].get('on') is False):
                 self._reset_bri_after_on = True
         return self.bridge.set_light(self.light_id, *args, **kwargs)
 
+    @property
+    def _batch(self):
+        # the calling thread's pending batch() state, or None outside batch()
+        return getattr(self._local, 'batch', None)
+
+    @_batch.setter
+    def _batch(self, batch):
+        self._local.batch = batch
+
+    def _add_to_batch(self, parameter, value=None, transitiontime=None):
+        # Inside batch(), collect writes instead of sending them.
+        if self._batch is None:
+            return False
+        if isinstance(parameter, dict):
+            self._batch.update(parameter)
+        else:
+            self._batch[parameter] = value
+        if transitiontime is not None:
+            self._batch['transitiontime'] = transitiontime
+        return True
+
+    def refresh(self):
+        '''Re-read the state of every light from the bridge (see Bridge.refresh_lights)'''
+        self.bridge.refresh_lights()
+        return self
+
+    # Light attributes cached on the object, by Hue API state name
+    _cached_attributes = {
+        'on': '_on', 'bri': '_brightness', 'hue': '_hue', 'sat': '_saturation', 'xy': '_xy',
+        'ct': '_colortemp', 'effect': '_effect', 'alert': '_alert',
+    }
+
+    def set_state(self, **state):
+        '''Set several attributes of the light in a single request
+
+        Takes Hue API state names, e.g. set_state(on=True, hue=430, sat=252, bri=252).
+        A transitiontime keyword applies to this request only. The light changes in a single
+        step rather than one attribute at a time.
+        '''
+        transitiontime = state.pop('transitiontime', None)
+        if 'hue' in state:
+            state['hue'] = int(state['hue'])
+        if state.get('alert', 'none') is None:
+            state['alert'] = 'none'
+
+        # see the on setter: restore brightness after a transitiontime power off
+        if state.get('on') is True and self._on is False and self._reset_bri_after_on:
+            if 'bri' not in state and self._brightness is not None:
+                state['bri'] = self._brightness
+            self._reset_bri_after_on = False
+
+        if transitiontime is None:
+            result = self._set(state)
+        else:
+            result = self._set(state, transitiontime=transitiontime)
+        for key, value in state.items():
+            if key in self._cached_attributes:
+                setattr(self, self._cached_attributes[key], value)
+        return result
+
+    @contextmanager
+    def batch(self):
+        '''Collect attribute writes and send them as one request on exit
+
+        Example:
+
+            >>> with light.batch():
+            ...     light.on = True
+            ...     light.hue = 430
+            ...     light.brightness = 252
+
+        Nothing is sent if the block raises. Only writes made by the thread that opened the
+        block are collected; other threads using the same Light send theirs as usual.
+        '''
+        if self._batch is not None:  # already batching; the outer block sends
+            yield self
+            return
+        self._batch = {}
+        try:
+            yield self
+        except Exception:
+            self._batch = None
+            raise
+        state, self._batch = self._batch, None
+        if state:
+            self.set_state(**state)
+
     @property
     def name(self):
         '''Get or set the name of the light [string]'''
@@ -464,19 +838,10 @@ class Group(Light):
         try:
             self.group_id = int(group_id)
         except:
-            name = group_id
-            groups = bridge.get_group()
-            for idnumber, info in groups.items():
-                if PY3K:
-                    if info['name'] == name:
-                        self.group_id = int(idnumber)
-                        break
-                else:
-                    if info['name'] == name.decode('utf-8'):
-                        self.group_id = int(idnumber)
-                        break
-            else:
+            idnumber = bridge.get_group_id_by_name(group_id)
+            if idnumber is False:
                 raise LookupError("Could not find a group by that name.")
+            self.group_id = int(idnumber)
 
     # Wrapper functions for get/set through the bridge, adding support for
     # remembering the transitiontime parameter if the user has set it
@@ -484,15 +849,19 @@ class Group(Light):
         return self.bridge.get_group(self.group_id, *args, **kwargs)
 
     def _set(self, *args, **kwargs):
+        if self._add_to_batch(*args, **kwargs):
+            return
+
         # let's get basic group functionality working first before adding
         # transition time...
         if self.transitiontime is not None:
-            kwargs['transitiontime'] = self.transitiontime
+            kwargs.setdefault('transitiontime', self.transitiontime)
             logger.debug("Setting with transitiontime = {0} ds = {1} s".format(
-                self.transitiontime, float(self.transitiontime) / 10))
+                kwargs['transitiontime'], float(kwargs['transitiontime']) / 10))
 
             if (args[0] == 'on' and args[1] is False) or (
-                    kwargs.get('on', True) is False):
+                    kwargs.get('on', True) is False) or (
+                    isinstance(args[0], dict) and args[0].get('on') is False):
                 self._reset_bri_after_on = True
         return self.bridge.set_group(self.group_id, *args, **kwargs)
 
@@ -515,10 +884,15 @@ class Group(Light):
 
     @property
     def lights(self):
-        """ Return a list of all lights in this group"""
-        # response = self.bridge.request('GET', '/api/{0}/groups/{1}'.format(self.bridge.username, self.group_id))
-        # return [Light(self.bridge, int(l)) for l in response['lights']]
-        return [Light(self.bridge, int(l)) for l in self._get('lights')]
+        """ Return a list of all lights in this group
+
+        Membership comes from the bridge's cached groups collection (see
+        Bridge.group_names) and the Light objects are the bridge's own.
+        """
+        info = self.bridge.group_names.collection().get(str(self.group_id))
+        light_ids = info['lights'] if info is not None else self._get('lights')  # group 0
+        lights = self.bridge.get_light_objects('id')
+        return [lights.get(int(l)) or Light(self.bridge, int(l)) for l in light_ids]
 
     @lights.setter
     def lights(self, value):
@@ -595,7 +969,9 @@ class Bridge(object):
 
 
     """
-    def __init__(self, ip=None, username=None, config_file_path=None):
+    def __init__(self, ip=None, username=None, config_file_path=None, pool_size=4,
+                 light_state_ttl=None, command_rate=10.0, group_fanout=False,
+                 name_index_ttl=300, dispatch_workers=1, fanout_group_limit=8):
         """ Initialization function.
 
         Parameters:
@@ -603,20 +979,65 @@ class Bridge(object):
         ip : string
             IP address as dotted quad
         username : string, optional
+        pool_size : int, optional
+            Maximum number of keep-alive connections held open to the bridge
+        light_state_ttl : float, optional
+            Enables snapshot mode: light getters are answered from one cached
+            GET of all lights for up to this many seconds. None (the default)
+            makes every getter read from the bridge.
+        command_rate : float, optional
+            Light commands per second sent through rate_limit, the one bucket
+            shared by submit_light, submit_group and concurrent dispatch
+        group_fanout : bool or 'create', optional
+            When set_light gives several lights the same state, send it as one
+            group action: to an existing group with exactly those lights, or to
+            group 0 if it is every light. With 'create', a managed group is
+            created for other sets of lights. set_light then returns the one
+            group response instead of a response per light.
+        fanout_group_limit : int, optional
+            Most managed groups kept on the bridge, which holds only 64 groups
+            in all. The least recently used one is deleted to make room; see
+            also delete_fanout_groups.
+        name_index_ttl : float, optional
+            Seconds a name to id index of lights, groups or sensors is reused
+            before it is rebuilt; None to rebuild only on invalidation
+        dispatch_workers : int, optional
+            With more than 1, set_light and set_group send the requests for a
+            list of ids concurrently on this many threads, paced to
+            command_rate. Network failures are then returned as per-light
+            error entries instead of raised.
 
         """
 
         if config_file_path is not None:
             self.config_file_path = config_file_path
-        elif os.getenv(USER_HOME) is not None and os.access(os.getenv(USER_HOME), os.W_OK):
-            self.config_file_path = os.path.join(os.getenv(USER_HOME), '.python_hue')
-        elif 'iPad' in platform.machine() or 'iPhone' in platform.machine() or 'iPad' in platform.machine():
-            self.config_file_path = os.path.join(os.getenv(USER_HOME), 'Documents', '.python_hue')
         else:
-            self.config_file_path = os.path.join(os.getcwd(), '.python_hue')
+            self.config_file_path = default_config_file_path()
 
         self.ip = ip
         self.username = username
+        self.pool_size = pool_size
+        self.light_state_ttl = light_state_ttl
+        self.command_rate = command_rate
+        self.group_fanout = group_fanout
+        self.fanout_group_limit = fanout_group_limit
+        self._group_membership = None
+        self._fanout_groups = OrderedDict()  # managed group id -> lights, least recently used first
+        self._fanout_lock = threading.Lock()
+        self._scheduler = None
+        self.dispatch_workers = dispatch_workers
+        self._dispatcher = None
+        self.rate_limit = TokenBucket(command_rate)
+        self.light_names = NameIndex(self, 'lights', name_index_ttl)
+        self.group_names = NameIndex(self, 'groups', name_index_ttl)
+        self.sensor_names = NameIndex(self, 'sensors', name_index_ttl)
+        self.scene_names = NameIndex(self, 'scenes', name_index_ttl)
+        self._light_snapshot = None
+        self._light_snapshot_time = None
+        self._snapshot_lock = threading.Lock()
+        self._config_mtime = None
+        self._pool = None
+        self._pool_lock = threading.Lock()
         self.lights_by_id = {}
         self.lights_by_name = {}
         self.sensors_by_id = {}
@@ -642,33 +1063,124 @@ class Bridge(object):
         self.request(
             'PUT', '/api/' + self.username + '/config', data)
 
+    @property
+    def pool(self):
+        """ The keep-alive connection pool for the current bridge ip """
+        with self._pool_lock:
+            if self._pool is None or self._pool.host != self.ip:
+                if self._pool is not None:
+                    self._pool.close()
+                self._pool = ConnectionPool(self.ip, self.pool_size)
+            return self._pool
+
     def request(self, mode='GET', address=None, data=None):
         """ Utility function for HTTP GET/PUT requests for the API"""
-        connection = httplib.HTTPConnection(self.ip, timeout=10)
-
-        try:
-            if mode == 'GET' or mode == 'DELETE':
-                connection.request(mode, address)
-            if mode == 'PUT' or mode == 'POST':
-                connection.request(mode, address, json.dumps(data))
-
-            logger.debug("{0} {1} {2}".format(mode, address, str(data)))
-
-        except socket.timeout:
-            error = "{} Request to {}{} timed out.".format(mode, self.ip, address)
-
-            logger.exception(error)
-            raise PhueRequestTimeout(None, error)
+        body = None
+        if mode == 'PUT' or mode == 'POST':
+            body = json.dumps(data)
+
+        pool = self.pool
+        while True:
+            # a request that can't be resent never rides an idle connection the bridge may
+            # already have closed
+            connection, reused = pool.acquire(fresh=mode not in RETRY_METHODS)
+            try:
+                connection.request(mode, address, body)
+                logger.debug("{0} {1} {2}".format(mode, address, str(data)))
+                result = connection.getresponse()
+                response = result.read()
+            except socket.timeout:
+                pool.discard(connection)
+                error = "{} Request to {}{} timed out.".format(mode, self.ip, address)
+
+                logger.exception(error)
+                raise PhueRequestTimeout(None, error)
+            except (httplib.HTTPException, socket.error):
+                pool.discard(connection)
+                # The bridge drops idle keep-alive connections; retry those on a fresh one.
+                if reused and mode in RETRY_METHODS:
+                    logger.debug("Reconnecting to {0} after connection reset".format(self.ip))
+                    continue
+                raise
+            except BaseException:
+                # e.g. KeyboardInterrupt mid-response; the connection can't be reused
+                pool.discard(connection)
+                raise
+            if result.will_close:
+                pool.discard(connection)
+            else:
+                pool.release(connection)
+            break
 
-        result = connection.getresponse()
-        response = result.read()
-        connection.close()
         if PY3K:
             return json.loads(response.decode('utf-8'))
         else:
             logger.debug(response)
             return json.loads(response)
 
+    @property
+    def scheduler(self):
+        """ The rate-limited CommandScheduler for this bridge, created on first use """
+        with self._pool_lock:
+            if self._scheduler is None:
+                self._scheduler = CommandScheduler(self)
+            return self._scheduler
+
+    def submit_light(self, light_id, parameter, value=None, transitiontime=None):
+        """ Queue a light state change through the rate-limited scheduler.
+
+        Takes the same arguments as set_light, for a single light. Pending
+        changes to the same light are merged. Returns a Future that resolves
+        to the set_light result.
+        """
+        data = parameter if isinstance(parameter, dict) else {parameter: value}
+        if transitiontime is not None:
+            data = dict(data, transitiontime=int(round(transitiontime)))
+        return self.scheduler.submit('light', light_id, data)
+
+    def submit_group(self, group_id, parameter, value=None, transitiontime=None):
+        """ Queue a group action through the rate-limited scheduler; see submit_light """
+        data = parameter if isinstance(parameter, dict) else {parameter: value}
+        if transitiontime is not None:
+            data = dict(data, transitiontime=int(round(transitiontime)))
+        return self.scheduler.submit('group', group_id, data)
+
+    @property
+    def dispatcher(self):
+        """ The thread pool used for concurrent set_light and set_group, created on first use """
+        with self._pool_lock:
+            if self._dispatcher is None:
+                self._dispatcher = ThreadPoolExecutor(self.dispatch_workers)
+            return self._dispatcher
+
+    def _dispatch(self, send, targets, cost=1):
+        # Call send(target) for every target on the dispatcher, paced by the
+        # rate limit. Repeats of one target run in order on the same thread.
+        # Returns the results in the order of targets; a request that raised
+        # becomes a bridge-style error entry.
+        def run(indexes):
+            results = []
+            for index in indexes:
+                self.rate_limit.acquire(cost)
+                try:
+                    results.append(send(targets[index]))
+                except Exception as e:
+                    logger.warn("ERROR: {0!r} for {1}".format(e, targets[index]))
+                    results.append([{'error': {
+                        'type': None, 'address': str(targets[index]), 'description': str(e)}}])
+            return results
+
+        by_target = OrderedDict()
+        for index, target in enumerate(targets):
+            by_target.setdefault(str(target), []).append(index)
+        futures = [(indexes, self.dispatcher.submit(run, indexes))
+                   for indexes in by_target.values()]
+        result = [None] * len(targets)
+        for indexes, future in futures:
+            for index, value in zip(indexes, future.result()):
+                result[index] = value
+        return result
+
     def get_ip_address(self, set_result=False):
 
         """ Get the bridge ip address from the meethue.com nupnp api """
@@ -733,6 +1245,7 @@ class Bridge(object):
 
         if self.ip is None or self.username is None:
             try:
+                mtime = os.path.getmtime(self.config_file_path)
                 with open(self.config_file_path) as f:
                     config = json.loads(f.read())
                     if self.ip is None:
@@ -742,6 +1255,7 @@ class Bridge(object):
                         logger.info('Using ip: ' + self.ip)
                     if self.username is None:
                         self.username = config[self.ip]['username']
+                        self._config_mtime = mtime
                         logger.info(
                             'Using username from config: ' + self.username)
                     else:
@@ -751,17 +1265,28 @@ class Bridge(object):
                     'Error opening config file, will attempt bridge registration')
                 self.register_app()
 
+    def reload_config(self):
+        """ Re-read the username from the config file, if it was loaded from there
+        and the file has changed since. Returns True if the config was reloaded. """
+        if self._config_mtime is None:
+            return False
+        try:
+            mtime = os.path.getmtime(self.config_file_path)
+            if mtime == self._config_mtime:
+                return False
+            with open(self.config_file_path) as f:
+                config = json.loads(f.read())
+            self.username = config[self.ip]['username']
+        except Exception:
+            logger.exception('Error reloading config file ' + self.config_file_path)
+            return False
+        self._config_mtime = mtime
+        logger.info('Reloaded username from config: ' + self.username)
+        return True
+
     def get_light_id_by_name(self, name):
         """ Lookup a light id based on string name. Case-sensitive. """
-        lights = self.get_light()
-        for light_id in lights:
-            if PY3K:
-                if name == lights[light_id]['name']:
-                    return light_id
-            else:
-                if name.decode('utf-8') == lights[light_id]['name']:
-                    return light_id
-        return False
+        return self.light_names.lookup(name)
 
     def get_light_objects(self, mode='list'):
         """Returns a collection containing the lights, either by name or id (use 'id' or 'name' as the mode)
@@ -783,15 +1308,7 @@ class Bridge(object):
 
     def get_sensor_id_by_name(self, name):
         """ Lookup a sensor id based on string name. Case-sensitive. """
-        sensors = self.get_sensor()
-        for sensor_id in sensors:
-            if PY3K:
-                if name == sensors[sensor_id]['name']:
-                    return sensor_id
-            else:
-                if name.decode('utf-8') == sensors[sensor_id]['name']:
-                    return sensor_id
-        return False
+        return self.sensor_names.lookup(name)
 
     def get_sensor_objects(self, mode='list'):
         """Returns a collection containing the sensors, either by name or id (use 'id' or 'name' as the mode)
@@ -837,15 +1354,63 @@ class Bridge(object):
         """ Returns the full api dictionary """
         return self.request('GET', '/api/' + self.username)
 
+    def refresh_lights(self):
+        """ Fetch every light in one request and store it as the light state snapshot """
+        lights = self.request('GET', '/api/' + self.username + '/lights/')
+        self.light_names.update(lights)
+        if isinstance(lights, dict):
+            with self._snapshot_lock:
+                self._light_snapshot = lights
+                self._light_snapshot_time = monotonic()
+        return lights
+
+    def _snapshot_state(self, light_id):
+        # The light's JSON from a fresh enough snapshot, refreshing it if needed,
+        # or None when snapshot mode is off.
+        if self.light_state_ttl is None:
+            return None
+        with self._snapshot_lock:
+            fresh = (self._light_snapshot is not None and
+                     monotonic() - self._light_snapshot_time <= self.light_state_ttl)
+            lights = self._light_snapshot
+        if not fresh:
+            lights = self.refresh_lights()
+        return lights.get(str(light_id)) if isinstance(lights, dict) else None
+
+    def _update_snapshot(self, light_id, data):
+        # write-through from set_light, so the snapshot reflects our own writes
+        with self._snapshot_lock:
+            if self._light_snapshot is None:
+                return
+            light = self._light_snapshot.get(str(light_id))
+            if light is None:
+                return
+            for key, value in data.items():
+                if key in ('name', 'type', 'uniqueid', 'swversion'):
+                    light[key] = value
+                elif key != 'transitiontime':
+                    light.setdefault('state', {})[key] = value
+
+    def invalidate_lights(self):
+        """ Drop the light state snapshot; the next getter reads from the bridge """
+        with self._snapshot_lock:
+            self._light_snapshot = None
+
     def get_light(self, light_id=None, parameter=None):
         """ Gets state by light_id and parameter"""
 
         if is_string(light_id):
             light_id = self.get_light_id_by_name(light_id)
         if light_id is None:
-            return self.request('GET', '/api/' + self.username + '/lights/')
-        state = self.request(
-            'GET', '/api/' + self.username + '/lights/' + str(light_id))
+            if self.light_state_ttl is not None:
+                return self.refresh_lights()
+            lights = self.request('GET', '/api/' + self.username + '/lights/')
+            self.light_names.update(lights)
+            return lights
+        state = self._snapshot_state(light_id)
+        if state is None:
+            state = self.request(
+                'GET', '/api/' + self.username + '/lights/' + str(light_id))
         if parameter is None:
             return state
         if parameter in ['name', 'type', 'uniqueid', 'swversion']:
@@ -870,6 +1435,10 @@ class Bridge(object):
                          Use the Light class' transitiontime attribute if you want
                          persistent time settings.
 
+        Returns a response per light. With group_fanout, a list of lights
+        sent as one group action returns the set_group result instead: a
+        single response for the whole group.
+
         """
         if isinstance(parameter, dict):
             data = parameter
@@ -883,26 +1452,118 @@ class Bridge(object):
         light_id_array = light_id
         if isinstance(light_id, int) or is_string(light_id):
             light_id_array = [light_id]
-        result = []
-        for light in light_id_array:
+        elif self.group_fanout and parameter != 'name' and len(light_id_array) > 1:
+            result = self._set_lights_by_group(light_id_array, data)
+            if result is not None:
+                return result
+
+        def send(light):
             logger.debug(str(data))
             if parameter == 'name':
-                result.append(self.request('PUT', '/api/' + self.username + '/lights/' + str(
-                    light_id), data))
+                response = self.request('PUT', '/api/' + self.username + '/lights/' + str(
+                    light), data)
             else:
                 if is_string(light):
                     converted_light = self.get_light_id_by_name(light)
                 else:
                     converted_light = light
-                result.append(self.request('PUT', '/api/' + self.username + '/lights/' + str(
-                    converted_light) + '/state', data))
-            if 'error' in list(result[-1][0].keys()):
+                response = self.request('PUT', '/api/' + self.username + '/lights/' + str(
+                    converted_light) + '/state', data)
+            if 'error' in list(response[0].keys()):
                 logger.warn("ERROR: {0} for light {1}".format(
-                    result[-1][0]['error']['description'], light))
+                    response[0]['error']['description'], light))
+            elif parameter == 'name':
+                self.light_names.rename(light, value)
+                self._update_snapshot(light, data)
+            else:
+                self._update_snapshot(converted_light, data)
+            return response
+
+        if self.dispatch_workers > 1 and len(light_id_array) > 1:
+            result = self._dispatch(send, list(light_id_array))
+        else:
+            result = [send(light) for light in light_id_array]
 
         logger.debug(result)
         return result
 
+    def _set_lights_by_group(self, light_ids, data):
+        # Send one state to several lights as a single group action. Returns
+        # the set_group result, or None if no group fits these lights.
+        light_ids = [self.get_light_id_by_name(x) if is_string(x) else x for x in light_ids]
+        if any(x is False or x is None for x in light_ids):
+            # an unknown name; sent per light, it gets its own error entry
+            return None
+        group_id = self._fanout_group(light_ids)
+        if group_id is None:
+            return None
+        logger.debug("Setting lights {0} through group {1}".format(light_ids, group_id))
+        result = self.set_group(group_id, dict(data))
+        if result and 'error' not in list(result[-1][0].keys()):
+            for light in light_ids:
+                self._update_snapshot(light, data)
+        return result
+
+    def _fanout_group(self, light_ids):
+        """ The id of a group holding exactly light_ids, or None """
+        wanted = frozenset(str(x) for x in light_ids)
+        if wanted == frozenset(str(x) for x in self.get_light_objects('id')):
+            return 0
+        with self._fanout_lock:
+            membership = self._fanout_membership()
+            group_id = membership.get(wanted)
+            if str(group_id) in self._fanout_groups:
+                # most recently used last
+                self._fanout_groups[str(group_id)] = self._fanout_groups.pop(str(group_id))
+            if group_id is None and self.group_fanout == 'create':
+                group_id = self._create_fanout_group(membership, wanted)
+        return group_id
+
+    def _fanout_membership(self):
+        # lights -> group id for every group on the bridge, also adopting the
+        # managed groups left by an earlier Bridge so they count toward the limit
+        if self._group_membership is None:
+            groups = self.get_group()
+            membership = {}
+            for group_id, info in groups.items():
+                lights = frozenset(info.get('lights', ()))
+                membership[lights] = int(group_id)
+                if info.get('name', '').startswith(FANOUT_GROUP_PREFIX):
+                    self._fanout_groups.setdefault(str(group_id), lights)
+            for group_id in list(self._fanout_groups):
+                if group_id not in groups:
+                    del self._fanout_groups[group_id]
+            self._group_membership = membership
+        return self._group_membership
+
+    def _create_fanout_group(self, membership, wanted):
+        while self._fanout_groups and len(self._fanout_groups) >= self.fanout_group_limit:
+            group_id = next(iter(self._fanout_groups))
+            lights = self._fanout_groups[group_id]
+            self.delete_group(group_id)
+            if str(membership.get(lights)) == group_id:
+                del membership[lights]
+            logger.info("Deleted least recently used group {0}".format(group_id))
+        lights = sorted(wanted, key=int)
+        name = FANOUT_GROUP_PREFIX + '%08x' % (
+            zlib.crc32(','.join(lights).encode('utf-8')) & 0xffffffff)
+        result = self.create_group(name, lights)
+        self._group_membership = membership
+        if 'success' not in result[0]:
+            return None
+        group_id = int(result[0]['success']['id'])
+        membership[wanted] = group_id
+        self._fanout_groups[str(group_id)] = wanted
+        logger.info("Created group {0} ({1}) for lights {2}".format(group_id, name, lights))
+        return group_id
+
+    def delete_fanout_groups(self):
+        """ Delete every group made by group_fanout='create' from the bridge """
+        with self._fanout_lock:
+            self._fanout_membership()
+            for group_id in list(self._fanout_groups):
+                self.delete_group(group_id)
+
     # Sensors #####
 
     @property
@@ -935,6 +1596,7 @@ class Bridge(object):
             new_sensor = Sensor(self, int(new_id))
             self.sensors_by_id[new_id] = new_sensor
             self.sensors_by_name[name] = new_sensor
+            self.sensor_names.invalidate()
             return new_id, None
         else:
             logger.debug("Failed to create sensor:" + repr(result[0]))
@@ -946,7 +1608,9 @@ class Bridge(object):
         if is_string(sensor_id):
             sensor_id = self.get_sensor_id_by_name(sensor_id)
         if sensor_id is None:
-            return self.request('GET', '/api/' + self.username + '/sensors/')
+            sensors = self.request('GET', '/api/' + self.username + '/sensors/')
+            self.sensor_names.update(sensors)
+            return sensors
         data = self.request(
             'GET', '/api/' + self.username + '/sensors/' + str(sensor_id))
 
@@ -977,6 +1641,8 @@ class Bridge(object):
         if 'error' in list(result[0].keys()):
             logger.warn("ERROR: {0} for sensor {1}".format(
                 result[0]['error']['description'], sensor_id))
+        elif 'name' in data:
+            self.sensor_names.rename(sensor_id, data['name'])
 
         logger.debug(result)
         return result
@@ -1031,6 +1697,7 @@ class Bridge(object):
             name = self.sensors_by_id[sensor_id].name
             del self.sensors_by_name[name]
             del self.sensors_by_id[sensor_id]
+            self.sensor_names.invalidate()
             return self.request('DELETE', '/api/' + self.username + '/sensors/' + str(sensor_id))
         except:
             logger.debug("Unable to delete nonexistent sensor with ID {0}".format(sensor_id))
@@ -1043,15 +1710,7 @@ class Bridge(object):
 
     def get_group_id_by_name(self, name):
         """ Lookup a group id based on string name. Case-sensitive. """
-        groups = self.get_group()
-        for group_id in groups:
-            if PY3K:
-                if name == groups[group_id]['name']:
-                    return group_id
-            else:
-                if name.decode('utf-8') == groups[group_id]['name']:
-                    return group_id
-        return False
+        return self.group_names.lookup(name)
 
     def get_group(self, group_id=None, parameter=None):
         if is_string(group_id):
@@ -1060,7 +1719,9 @@ class Bridge(object):
             logger.error('Group name does not exit')
             return
         if group_id is None:
-            return self.request('GET', '/api/' + self.username + '/groups/')
+            groups = self.request('GET', '/api/' + self.username + '/groups/')
+            self.group_names.update(groups)
+            return groups
         if parameter is None:
             return self.request('GET', '/api/' + self.username + '/groups/' + str(group_id))
         elif parameter == 'name' or parameter == 'lights':
@@ -1093,9 +1754,8 @@ class Bridge(object):
         group_id_array = group_id
         if isinstance(group_id, int) or is_string(group_id):
             group_id_array = [group_id]
-        result = []
+        converted_groups = []
         for group in group_id_array:
-            logger.debug(str(data))
             if is_string(group):
                 converted_group = self.get_group_id_by_name(group)
             else:
@@ -1103,14 +1763,31 @@ class Bridge(object):
             if converted_group is False:
                 logger.error('Group name does not exit')
                 return
+            converted_groups.append(converted_group)
+        if parameter == 'lights':
+            self._group_membership = None
+
+        def send(converted_group):
+            logger.debug(str(data))
             if parameter == 'name' or parameter == 'lights':
-                result.append(self.request('PUT', '/api/' + self.username + '/groups/' + str(converted_group), data))
+                response = self.request('PUT', '/api/' + self.username + '/groups/' + str(converted_group), data)
+                if parameter == 'name' and 'error' not in list(response[0].keys()):
+                    self.group_names.rename(converted_group, value)
             else:
-                result.append(self.request('PUT', '/api/' + self.username + '/groups/' + str(converted_group) + '/action', data))
+                response = self.request('PUT', '/api/' + self.username + '/groups/' + str(converted_group) + '/action', data)
+            return response
+
+        if self.dispatch_workers > 1 and len(converted_groups) > 1:
+            result = self._dispatch(send, converted_groups, GROUP_COMMAND_COST)
+        else:
+            result = [send(group) for group in converted_groups]
+        if parameter == 'lights':
+            self.group_names.invalidate()
 
-        if 'error' in list(result[-1][0].keys()):
-            logger.warn("ERROR: {0} for group {1}".format(
-                result[-1][0]['error']['description'], group))
+        for group, response in zip(group_id_array, result):
+            if 'error' in list(response[0].keys()):
+                logger.warn("ERROR: {0} for group {1}".format(
+                    response[0]['error']['description'], group))
 
         logger.debug(result)
         return result
@@ -1127,9 +1804,14 @@ class Bridge(object):
 
         """
         data = {'lights': [str(x) for x in lights], 'name': name}
+        self._group_membership = None
+        self.group_names.invalidate()
         return self.request('POST', '/api/' + self.username + '/groups/', data)
 
     def delete_group(self, group_id):
+        self._fanout_groups.pop(str(group_id), None)
+        self._group_membership = None
+        self.group_names.invalidate()
         return self.request('DELETE', '/api/' + self.username + '/groups/' + str(group_id))
 
     # Scenes #####
@@ -1138,7 +1820,9 @@ class Bridge(object):
         return [Scene(k, **v) for k, v in self.get_scene().items()]
 
     def get_scene(self):
-        return self.request('GET', '/api/' + self.username + '/scenes')
+        scenes = self.request('GET', '/api/' + self.username + '/scenes')
+        self.scene_names.update(scenes)
+        return scenes
 
     def activate_scene(self, group_id, scene_id):
         return self.request('PUT', '/api/' + self.username + '/groups/' +
@@ -1161,26 +1845,38 @@ class Bridge(object):
         perfect, but is convenient for setting lights symbolically (and
         can be improved later).
 
+        Groups and scenes are read from the cached collections of
+        group_names and scene_names, which are refetched once if either
+        name isn't found.
+
         """
-        groups = [x for x in self.groups if x.name == group_name]
-        scenes = [x for x in self.scenes if x.name == scene_name]
+        for attempt in (0, 1):
+            if attempt:
+                self.group_names.refresh()
+                self.scene_names.refresh()
+            groups = [(group_id, info) for group_id, info in self.group_names.collection().items()
+                      if info.get('name') == group_name]
+            scenes = [(scene_id, info) for scene_id, info in self.scene_names.collection().items()
+                      if info.get('name') == scene_name]
+            if len(groups) == 1 and scenes:
+                break
         if len(groups) != 1:
             logger.warn("run_scene: More than 1 group found by name %s",
                         group_name)
             return
-        group = groups[0]
+        group_id, group = groups[0]
         if len(scenes) == 0:
             logger.warn("run_scene: No scene found %s", scene_name)
             return
         if len(scenes) == 1:
-            self.activate_scene(group.group_id, scenes[0].scene_id)
+            self.activate_scene(group_id, scenes[0][0])
             return
         # otherwise, lets figure out if one of the named scenes uses
         # all the lights of the group
-        group_lights = sorted([x.light_id for x in group.lights])
-        for scene in scenes:
-            if group_lights == scene.lights:
-                self.activate_scene(group.group_id, scene.scene_id)
+        group_lights = sorted(int(x) for x in group.get('lights', ()))
+        for scene_id, scene in scenes:
+            if group_lights == sorted(int(x) for x in scene.get('lights', ())):
+                self.activate_scene(group_id, scene_id)
                 return
         logger.warn("run_scene: did not find a scene: %s "
                     "that shared lights with group %s",
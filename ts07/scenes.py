@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import OrderedDict, namedtuple
+from io import open
+import json
+from logging import getLogger
+from threading import Lock
+
+from .fanout import remaining
+from .ufo import Ufo
+
+log = getLogger(__name__)
+
+# name: the scene's name in the config file and in /scene/<name>
+# label, button_class, style: how its button is drawn on the index page
+# tasks: (key, fn, args) tasks for the fan-out engine, built once when the file is loaded
+Scene = namedtuple('Scene', ('name', 'label', 'button_class', 'style', 'tasks'))
+
+DEFAULT_BUTTON_CLASS = 'btn btn-primary btn-lg btn-block'
+
+
+class SceneError(ValueError):
+    pass
+
+
+def _merge_targets(targets, settings, what):
+    # {'*': {...}, 'target': {...}} -> OrderedDict of target -> settings, '*' applied to every
+    # target and overridden by the target's own entry
+    unknown = set(settings) - set(targets) - {'*'}
+    if unknown:
+        raise SceneError("unknown %s: %s" % (what, ', '.join(sorted(unknown))))
+    merged = OrderedDict()
+    for target in targets:
+        if '*' in settings or target in settings:
+            merged[target] = dict(settings.get('*', {}), **settings.get(target, {}))
+    return merged
+
+
+class SceneRegistry(object):
+    """Scenes loaded from a JSON file and compiled into ready-to-run device tasks.
+
+    The file names the UFO controllers ("ufos": name -> ip), the Hue bridge and its lights
+    ("hue": {"bridge": ip, "lights": name -> position in the bridge's light list}) and the
+    scenes. Each scene gives UFO settings ({"color": [r, g, b, w], "power": bool}) and a Hue
+    state payload per device name, with "*" for every device of that kind; a device's own entry
+    is merged over "*". See scenes.json.
+
+    UFO frames and Hue payloads are built when the file is loaded, so activating a scene only
+    sends them. ``get_bridge`` is called with the bridge ip to get the Bridge to send through.
+    ``hue_bridge`` and ``hue_lights`` hold the file's Hue section, for reading the lights back.
+    """
+
+    def __init__(self, get_bridge):
+        self.get_bridge = get_bridge
+        self.path = None
+        self.hue_bridge = None
+        self.hue_lights = OrderedDict()  # light name -> position in the bridge's light list
+        self._scenes = OrderedDict()
+        self._hue_light_ids = {}
+        self._lock = Lock()
+
+    def load(self, path):
+        """Read and compile the scenes in path, replacing the current ones."""
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f, object_pairs_hook=OrderedDict)
+        scenes = self.compile(config)
+        hue = config.get('hue', {})
+        with self._lock:
+            self.path = path
+            self.hue_bridge = hue.get('bridge')
+            self.hue_lights = OrderedDict(hue.get('lights', {}))
+            self._scenes = scenes
+            self._hue_light_ids = {}
+        log.info("Loaded %d scenes from %s", len(scenes), path)
+        return self
+
+    def compile(self, config):
+        ufos = OrderedDict((name, Ufo(ip)) for name, ip in config.get('ufos', {}).items())
+        hue = config.get('hue', {})
+        hue_lights = hue.get('lights', {})
+        scenes = OrderedDict()
+        for name, scene in config.get('scenes', {}).items():
+            try:
+                tasks = []
+                for ufo_name, settings in _merge_targets(ufos, scene.get('ufo', {}), 'ufos').items():
+                    parts = Ufo.compile(settings.get('color'), settings.get('power'))
+                    tasks.append((ufo_name, ufos[ufo_name].send_compiled, (parts,)))
+                for light_name, state in _merge_targets(hue_lights, scene.get('hue', {}),
+                                                        'hue lights').items():
+                    tasks.append((light_name, self._set_hue_light,
+                                  (hue['bridge'], hue_lights[light_name], state)))
+            except (KeyError, TypeError, SceneError) as e:
+                raise SceneError("scene %r: %s" % (name, e))
+            scenes[name] = Scene(name, scene.get('label', name),
+                                 scene.get('class', DEFAULT_BUTTON_CLASS), scene.get('style'),
+                                 tuple(tasks))
+        return scenes
+
+    def hue_light(self, name):
+        """The phue Light for a Hue light named in the file."""
+        return self.get_bridge(self.hue_bridge).lights[self.hue_lights[name]]
+
+    def _set_hue_light(self, bridge_ip, position, state):
+        bridge = self.get_bridge(bridge_ip)
+        light_id = self._hue_light_ids.get((bridge_ip, position))
+        if light_id is None:
+            light_id = self._hue_light_ids[(bridge_ip, position)] = bridge.lights[position].light_id
+        # don't hold the fan-out thread (and the device in SceneDispatcher) past the deadline
+        # while the scheduler works through a backlog; the command itself stays queued
+        return bridge.submit_light(light_id, state).result(remaining())
+
+    def __contains__(self, name):
+        return name in self._scenes
+
+    def __getitem__(self, name):
+        return self._scenes[name]
+
+    def __iter__(self):
+        return iter(list(self._scenes.values()))
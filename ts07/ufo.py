@@ -30,133 +30,697 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-from collections import namedtuple
-from socket import AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST, SO_REUSEADDR, socket, timeout
-from struct import pack, unpack
+from collections import OrderedDict, namedtuple
+from logging import getLogger
+from select import select
+from socket import (AF_INET, IPPROTO_TCP, SOCK_DGRAM, SOCK_STREAM, SOL_SOCKET, SO_BROADCAST,
+                    SO_KEEPALIVE, SO_REUSEADDR, TCP_NODELAY, error as socket_error, socket,
+                    timeout as socket_timeout)
+from struct import Struct
+from threading import Event, Lock, Thread
 from time import sleep
 
+from .fanout import fan_out
+
+try:
+    from time import monotonic
+except ImportError:  # pragma: no cover
+    from time import time as monotonic
+
 # Resources:
 #   https://github.com/sidoh/ledenet_api/blob/master/lib/ledenet/api.rb
 #   https://github.com/home-assistant/home-assistant/issues/530#issuecomment-150887786
 #   https://github.com/home-assistant/home-assistant/issues/530#issuecomment-157218268
 
+log = getLogger(__name__)
+
 API_PORT = 5577
+DISCOVERY_PORT = 48899
+DISCOVERY_MESSAGE = b'HF-A11ASSISTHREAD'
 Status = namedtuple('Status', ('packet_id', 'device_name', 'power_status', 'mode',
                                'run_status', 'speed', 'red', 'green', 'blue', 'warm_white',
                                'unused_1', 'unused_2', 'unused_3', 'checksum'))
+STATUS_LENGTH = 14
+FRAME_CACHE_SIZE = 256
+
+# Every packet is a run of unsigned bytes, so precompile one Struct per packet length.
+_frame_structs = dict((length, Struct(">%dB" % length)) for length in range(1, STATUS_LENGTH + 1))
+_status_struct = _frame_structs[STATUS_LENGTH]
+
+
+class _FrameCache(object):
+    # Bounded LRU of ready-to-send frames, keyed by payload (the frame minus its checksum).
+    # Scenes and animations send the same few payloads over and over.
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._frames = OrderedDict()
+        self._lock = Lock()
+
+    def __call__(self, payload):
+        with self._lock:
+            frame = self._frames.pop(payload, None)
+            if frame is None:
+                frame = _frame_structs[len(payload) + 1].pack(*payload + (sum(payload) % 0x100,))
+                if len(self._frames) >= self.maxsize:
+                    self._frames.popitem(last=False)
+            self._frames[payload] = frame
+        return frame
+
+
+_frame_cache = _FrameCache(FRAME_CACHE_SIZE)
+
+
+def _frame(*bytes):
+    return _frame_cache(bytes)
+
+
+def _rgbw_frame(r, g, b, w):
+    packet_id = 0x31
+    unused_payload = 0
+    remote_or_local = 0x0F
+    return _frame(packet_id, r, g, b, w, unused_payload, remote_or_local)
+
+
+STATUS_REQUEST = _frame_structs[4].pack(0x81, 0x8A, 0x8B, 0x96)
+ON_FRAME = _frame(0x71, 0x23, 0x0F)
+OFF_FRAME = _frame(0x71, 0x24, 0x0F)
+
+
+class UfoError(Exception):
+    pass
+
+
+class UfoTimeout(UfoError):
+    pass
+
+
+class UfoConnectionError(UfoError):
+    pass
+
+
+class UfoProtocolError(UfoError):
+    pass
+
+
+def _decode_status(data):
+    # data may be bytes or a memoryview over the receive buffer; unpack_from reads either in place
+    if len(data) != STATUS_LENGTH:
+        raise UfoProtocolError("status response is %d bytes, expected %d"
+                               % (len(data), STATUS_LENGTH))
+    stts = Status._make(_status_struct.unpack_from(data))
+    if stts.packet_id != 0x81:
+        raise UfoProtocolError("unexpected status packet id 0x%02x" % stts.packet_id)
+    if stts.checksum != sum(stts[:-1]) % 0x100:
+        raise UfoProtocolError("status checksum mismatch: got 0x%02x, expected 0x%02x"
+                               % (stts.checksum, sum(stts[:-1]) % 0x100))
+    return stts
+
+
+def _recv_exactly(s, size, deadline):
+    # Wait only as long as the controller actually takes, but never past the deadline. Reads
+    # straight into one preallocated buffer and returns a memoryview over it.
+    view = memoryview(bytearray(size))
+    received = 0
+    while received < size:
+        remaining = deadline - monotonic()
+        readable = remaining > 0 and select([s], [], [], remaining)[0]
+        if not readable:
+            raise UfoTimeout("received %d of %d bytes before the deadline" % (received, size))
+        count = s.recv_into(view[received:])
+        if not count:
+            raise UfoConnectionError("connection closed after %d of %d bytes" % (received, size))
+        received += count
+    return view
+
+
+def _close_quietly(s):
+    try:
+        s.close()
+    except socket_error:
+        pass
+
+
+def _is_healthy(s):
+    # An idle controller connection should have nothing to read. If select reports it readable,
+    # the controller has either closed or reset it (recv would return b'' or raise), or left
+    # stray bytes behind that would corrupt the next status read. Either way, don't reuse it.
+    try:
+        readable, _, errored = select([s], [], [s], 0)
+    except (ValueError, socket_error):
+        return False
+    return not readable and not errored
+
+
+class ConnectionPool(object):
+    """Keeps persistent TCP connections to UFO controllers, keyed by IP address.
+
+    Connections are checked out for a single exchange and returned afterward. A returned
+    connection is kept for reuse until it has sat idle for longer than ``idle_timeout`` seconds.
+    Before reuse, each connection is health-checked, and connections the controller has
+    dropped are discarded. The controllers accept only a handful of concurrent clients, so at
+    most ``max_idle`` connections per device are held open, and while any are held a
+    background thread closes those past ``idle_timeout`` even if no more traffic comes.
+
+    """
+
+    def __init__(self, max_idle=1, idle_timeout=30.0, connect_timeout=2.0):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self._idle = {}  # ip_address -> [(socket, last_used), ...]
+        self._lock = Lock()
+        self._reaper = None
+
+    def _connect(self, ip_address, deadline=None):
+        # connect_timeout bounds a connect on its own; a caller's deadline can cut it shorter
+        timeout = self.connect_timeout
+        if deadline is not None:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                raise UfoTimeout("no time left to connect to %s" % ip_address)
+            timeout = min(timeout, remaining)
+        s = socket(AF_INET, SOCK_STREAM)
+        try:
+            s.setsockopt(SOL_SOCKET, SO_KEEPALIVE, 1)
+            s.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+            s.settimeout(timeout)
+            s.connect((ip_address, API_PORT))
+        except socket_timeout:
+            _close_quietly(s)
+            raise UfoTimeout("connect to %s timed out after %.3fs" % (ip_address, timeout))
+        except socket_error:
+            _close_quietly(s)
+            raise
+        return s
+
+    def acquire(self, ip_address, deadline=None):
+        """Check out a connection to ip_address.
+
+        Returns a (socket, reused) tuple. ``reused`` is True when the socket came from the pool
+        rather than from a fresh connect. A fresh connect gives up at ``deadline`` (a
+        monotonic() time) if that comes before ``connect_timeout``, raising UfoTimeout.
+        """
+        now = monotonic()
+        with self._lock:
+            idle = self._idle.get(ip_address)
+            while idle:
+                s, last_used = idle.pop()
+                if now - last_used <= self.idle_timeout and _is_healthy(s):
+                    return s, True
+                _close_quietly(s)
+        return self._connect(ip_address, deadline), False
+
+    def release(self, ip_address, s):
+        """Return a healthy connection to the pool after a completed exchange."""
+        now = monotonic()
+        with self._lock:
+            self._evict(now)
+            idle = self._idle.setdefault(ip_address, [])
+            if len(idle) < self.max_idle:
+                idle.append((s, now))
+                if self._reaper is None:
+                    self._reaper = Thread(target=self._reap, name='ufo-pool-reaper')
+                    self._reaper.daemon = True
+                    self._reaper.start()
+                return
+        _close_quietly(s)
+
+    def discard(self, s):
+        """Close a connection that failed mid-exchange instead of returning it to the pool."""
+        _close_quietly(s)
+
+    def _evict(self, now):
+        for ip_address, idle in list(self._idle.items()):
+            keep = []
+            for s, last_used in idle:
+                if now - last_used <= self.idle_timeout:
+                    keep.append((s, last_used))
+                else:
+                    _close_quietly(s)
+            if keep:
+                self._idle[ip_address] = keep
+            else:
+                del self._idle[ip_address]
+
+    def evict_idle(self):
+        """Close every pooled connection that has exceeded ``idle_timeout``."""
+        with self._lock:
+            self._evict(monotonic())
+
+    def _reap(self):
+        # runs while connections are pooled; exits once the pool is empty
+        while True:
+            sleep(self.idle_timeout / 2)
+            with self._lock:
+                self._evict(monotonic())
+                if not self._idle:
+                    self._reaper = None
+                    return
+
+    def close(self, ip_address=None):
+        """Close pooled connections for one device, or for all devices."""
+        with self._lock:
+            keys = list(self._idle) if ip_address is None else [ip_address]
+            for key in keys:
+                for s, _ in self._idle.pop(key, ()):
+                    _close_quietly(s)
+
+
+default_pool = ConnectionPool()
+
+
+class ShadowStore(object):
+    """Last-known power and color of each controller, keyed by IP address.
+
+    Entries are seeded from status reads and updated after every confirmed write, so Ufo can
+    skip commands that wouldn't change anything. Other clients (the phone app, the IR remote)
+    can change a controller behind our back, so an entry is trusted for only ``max_age``
+    seconds: long enough to absorb repeated taps on a button, short enough that a later press
+    goes out even if the controller was changed elsewhere in between.
+
+    """
+
+    def __init__(self, max_age=10.0):
+        self.max_age = max_age
+        self._state = {}  # ip_address -> {'power': bool, 'rgbw': tuple, ...: updated}
+        self._lock = Lock()
+
+    def get(self, ip_address, key):
+        """Return the last-known value of 'power' or 'rgbw', or None if unknown or stale."""
+        now = monotonic()
+        with self._lock:
+            entry = self._state.get(ip_address, {}).get(key)
+        if entry is None or now - entry[1] > self.max_age:
+            return None
+        return entry[0]
+
+    def update(self, ip_address, **values):
+        now = monotonic()
+        with self._lock:
+            entry = self._state.setdefault(ip_address, {})
+            for key, value in values.items():
+                if value is None:
+                    entry.pop(key, None)
+                else:
+                    entry[key] = (value, now)
+
+    def seed(self, ip_address, status):
+        is_on = (status.power_status & 0x01) == 0x01
+        # the color fields only mean something when the controller is showing a static color
+        rgbw = None
+        if status.mode == 0x61:
+            rgbw = (status.red, status.green, status.blue, status.warm_white)
+        self.update(ip_address, power=is_on, rgbw=rgbw)
+
+    def forget(self, ip_address=None):
+        with self._lock:
+            if ip_address is None:
+                self._state.clear()
+            else:
+                self._state.pop(ip_address, None)
+
+
+default_shadow = ShadowStore()
+
+
+class DiscoveryRegistry(object):
+    """Caches discovered controllers by hardware (MAC) address.
+
+    A discovery result is fresh for ``ttl`` seconds. Reading a stale registry returns the cached
+    devices immediately and starts a refresh in the background; only the very first read, or a
+    forced one, waits for a broadcast. A controller that comes back on a new IP address (DHCP)
+    keeps its Ufo object, which is updated in place. Controllers that haven't answered for
+    ``expire_after`` seconds are dropped.
+
+    If ``expected`` is set, a refresh ends as soon as that many controllers have answered,
+    instead of waiting out ``discovery_timeout``.
+
+    """
+
+    def __init__(self, ufo_class, ttl=60.0, expire_after=180.0, discovery_timeout=1.0,
+                 expected=None):
+        self.ufo_class = ufo_class
+        self.ttl = ttl
+        self.expire_after = expire_after
+        self.discovery_timeout = discovery_timeout
+        self.expected = expected
+        self._devices = {}  # hw_address -> (Ufo, last_seen)
+        self._refreshed_at = None
+        self._lock = Lock()
+        self._refresh_lock = Lock()
+        self._refresher = None
+        self._stop = Event()
+
+    def devices(self, refresh=False):
+        """Return the known controllers, sorted by IP address."""
+        if refresh or self._refreshed_at is None:
+            self.refresh()
+        elif monotonic() - self._refreshed_at > self.ttl:
+            self.refresh_in_background()
+        with self._lock:
+            ufos = [ufo for ufo, _ in self._devices.values()]
+        return tuple(sorted(ufos, key=lambda x: x.ip_address))
+
+    def refresh(self):
+        """Broadcast for controllers now and merge the replies into the registry."""
+        with self._refresh_lock:
+            replies = self.ufo_class.discover(self.discovery_timeout, self.expected)
+            self._merge((ufo.ip_address, ufo.hw_address) for ufo in replies)
+
+    def refresh_in_background(self):
+        if self._refresh_lock.locked():
+            return
+        thread = Thread(target=self._refresh_quietly, name='ufo-discovery')
+        thread.daemon = True
+        thread.start()
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception:
+            log.exception("background UFO discovery failed")
+
+    def _merge(self, replies):
+        now = monotonic()
+        with self._lock:
+            for ip_address, hw_address in replies:
+                known = self._devices.get(hw_address)
+                if known is None:
+                    ufo = self.ufo_class(ip_address, hw_address)
+                else:
+                    ufo = known[0]
+                    if ufo.ip_address != ip_address:
+                        log.info("UFO %s moved from %s to %s", hw_address, ufo.ip_address,
+                                 ip_address)
+                        ufo.pool.close(ufo.ip_address)
+                        ufo.shadow.forget(ufo.ip_address)
+                        ufo.ip_address = ip_address
+                self._devices[hw_address] = (ufo, now)
+            for hw_address, (_, last_seen) in list(self._devices.items()):
+                if now - last_seen > self.expire_after:
+                    del self._devices[hw_address]
+            self._refreshed_at = now
+
+    def start(self, interval=None):
+        """Keep the registry fresh from a background thread, every ``interval`` seconds."""
+        if self._refresher is not None:
+            return
+        interval = self.ttl if interval is None else interval
+        self._stop.clear()
+
+        def run():
+            while not self._stop.is_set():
+                self._refresh_quietly()
+                self._stop.wait(interval)
+
+        self._refresher = Thread(target=run, name='ufo-discovery')
+        self._refresher.daemon = True
+        self._refresher.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._refresher is not None:
+            self._refresher.join()
+            self._refresher = None
+
+    def clear(self):
+        with self._lock:
+            self._devices.clear()
+            self._refreshed_at = None
 
 
 class Ufo(object):
 
+    # seconds to wait for a complete status response
+    status_timeout = 1.0
+    # where discovery broadcasts go; point at an emulator (see ts07.emulator) for testing
+    discovery_address = '<broadcast>'
+
     @classmethod
-    def discover_all(cls):
-        s = socket(AF_INET, SOCK_DGRAM)
-        s.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-        s.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
-        s.sendto(b'HF-A11ASSISTHREAD', (b'<broadcast>', 48899))
-        s.settimeout(1)
+    def iter_discover(cls, timeout=1.0, expected=None, hw_addresses=None):
+        """Broadcast for controllers and yield each one as its reply arrives.
 
-        discovered = []
+        Bypasses the registry cache. Stops at ``timeout`` seconds, or as soon as ``expected``
+        controllers have answered, or as soon as every MAC address in ``hw_addresses`` has.
+        """
+        wanted = None if hw_addresses is None else set(h.upper() for h in hw_addresses)
+        seen = set()
+        s = socket(AF_INET, SOCK_DGRAM)
         try:
+            s.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+            s.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
+            s.sendto(DISCOVERY_MESSAGE, (cls.discovery_address, DISCOVERY_PORT))
+            deadline = monotonic() + timeout
             while True:
-                data = s.recv(1024)
-                discovered.append(cls(*data.decode('utf-8').split(',')[:2]))
-        except timeout:
+                if expected is not None and len(seen) >= expected:
+                    return
+                if wanted is not None and wanted <= seen:
+                    return
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return
+                s.settimeout(remaining)
+                try:
+                    data = s.recv(1024)
+                except socket_timeout:
+                    return
+                fields = data.decode('utf-8').split(',')
+                if len(fields) < 2 or fields[1].upper() in seen:
+                    continue  # not a controller, or a repeated reply
+                seen.add(fields[1].upper())
+                yield cls(*fields[:2])
+        finally:
             s.close()
 
+    @classmethod
+    def discover(cls, timeout=1.0, expected=None, hw_addresses=None, callback=None):
+        """Broadcast for controllers, bypassing the registry cache.
+
+        Takes the same early-exit arguments as iter_discover. If given, ``callback`` is called
+        with each Ufo as soon as it's discovered.
+        """
+        discovered = []
+        for ufo in cls.iter_discover(timeout, expected, hw_addresses):
+            if callback is not None:
+                callback(ufo)
+            discovered.append(ufo)
         return tuple(sorted(discovered, key=lambda x: x.ip_address))
 
     @classmethod
-    def all_on(cls):
+    def discover_all(cls, refresh=False):
+        """Return all known controllers from the discovery registry.
+
+        Answers from the cache when it has one; pass ``refresh=True`` to force a new broadcast.
+        """
+        return cls.registry.devices(refresh)
+
+    @classmethod
+    def all_on(cls, force=False):
         for ufo in cls.discover_all():
-            ufo.on()
+            ufo.on(force)
 
     @classmethod
-    def all_off(cls):
+    def all_off(cls, force=False):
         for ufo in cls.discover_all():
-            ufo.off()
+            ufo.off(force)
 
     @classmethod
-    def all_rgbw(cls, r, g, b, w):
+    def all_rgbw(cls, r, g, b, w, force=False):
         for ufo in cls.discover_all():
-            ufo.rgbw(r, g, b, w)
+            ufo.rgbw(r, g, b, w, force)
 
     @classmethod
-    def all_status(cls):
+    def collect_status(cls, ufos=None, timeout=2.0):
+        """Query every controller's status in parallel, under one overall deadline.
+
+        Returns a tuple of fanout.Outcome, one per controller, keyed by Ufo. Controllers that
+        fail or miss the deadline carry an error instead of a Status.
+        """
+        if ufos is None:
+            ufos = cls.discover_all()
+        return fan_out(((ufo, ufo.get_status, (timeout,)) for ufo in ufos), timeout)
+
+    @classmethod
+    def all_status(cls, timeout=2.0):
         builder = []
-        for ufo in cls.discover_all():
-            print(ufo)
-            builder.append(str(ufo))
+        for outcome in cls.collect_status(timeout=timeout):
+            builder.append(outcome.key.describe(outcome.value, outcome.error, outcome.elapsed))
         builder.append('')
         return '\n'.join(builder)
 
-    def __init__(self, ip_address, hw_address=None):
+    def __init__(self, ip_address, hw_address=None, pool=None, shadow=None):
         self.ip_address = ip_address
         self.hw_address = hw_address
+        self.pool = default_pool if pool is None else pool
+        self.shadow = default_shadow if shadow is None else shadow
 
     @property
     def status(self):
-        s = socket()
-        try:
-            s.connect((self.ip_address, API_PORT))
-
-            status_request = pack(">BBBB", 0x81, 0x8A, 0x8B, 0x96)
-            s.send(status_request)
-            sleep(0.2)
-
-            data = b''
-            while len(data) < 14:
-                data += s.recv(14)
-            stts = Status(*unpack(">" + "B" * 14, data))
-            assert stts.checksum == sum(stts[:-1]) % 0x100
-            return stts
-        finally:
-            s.close()
+        return self.get_status()
+
+    def get_status(self, timeout=None):
+        """Request and return the controller's Status.
+
+        Returns as soon as the full response arrives. Raises UfoTimeout if it hasn't arrived
+        within ``timeout`` seconds (default ``status_timeout``), and UfoProtocolError if the
+        response is malformed or fails its checksum.
+        """
+        if timeout is None:
+            timeout = self.status_timeout
+        deadline = monotonic() + timeout
+        status = _decode_status(self._exchange(STATUS_REQUEST, STATUS_LENGTH, deadline))
+        self.shadow.seed(self.ip_address, status)
+        return status
 
     @property
     def is_on(self):
         return (self.status.power_status & 0x01) == 0x01
 
     def __str__(self):
-        status = self.status
-        is_on = (status.power_status & 0x01) == 0x01
+        return self.describe(self.status)
+
+    def describe(self, status, error=None, elapsed=None):
         builder = []
         if self.hw_address:
             hw_addr = ':'.join(self.hw_address[i:i + 2] for i in range(0, 12, 2)).lower()
             builder.append("%s is %s" % (self.ip_address, hw_addr))
         else:
             builder.append(self.ip_address)
-        builder.append("  power: %s" % ('on' if is_on else 'off'))
-        builder.append("  rgbw: %s, %s, %s, %s" % (
-            status.red, status.green, status.blue, status.warm_white
-        ))
+        if error is not None:
+            builder.append("  error: %s" % (str(error) or type(error).__name__))
+        else:
+            is_on = (status.power_status & 0x01) == 0x01
+            builder.append("  power: %s" % ('on' if is_on else 'off'))
+            builder.append("  rgbw: %s, %s, %s, %s" % (
+                status.red, status.green, status.blue, status.warm_white
+            ))
+        if elapsed is not None:
+            builder.append("  elapsed: %.0f ms" % (elapsed * 1000))
         return '\n'.join(builder)
 
-    def _send_bytes(self, *bytes):
-        s = socket()
-        checksum = sum(bytes) % 0x100
-        payload = bytes + (checksum,)
+    def _exchange(self, data, response_length=0, deadline=None, confirm_reused=False):
+        # A pooled connection can pass its health check and still turn out to be dead (e.g. the
+        # controller rebooted). In that case reconnect once, transparently.
+        #
+        # A controller that rebooted without closing the connection can also swallow a write:
+        # sendall only hands the data to the kernel. With confirm_reused, a write without a
+        # response on a reused connection gets a status request appended, and the Status bytes
+        # are returned; if no answer comes, the write is repeated on a fresh connection.
+        while True:
+            s, reused = self.pool.acquire(self.ip_address, deadline)
+            confirming = reused and confirm_reused and not response_length
+            try:
+                if confirming:
+                    s.sendall(data + STATUS_REQUEST)
+                    response = _recv_exactly(s, STATUS_LENGTH, monotonic() + self.status_timeout)
+                else:
+                    s.sendall(data)
+                    response = (_recv_exactly(s, response_length, deadline)
+                                if response_length else b'')
+            except (socket_error, UfoConnectionError):
+                self.pool.discard(s)
+                if reused:
+                    continue
+                raise
+            except UfoTimeout:
+                self.pool.discard(s)
+                if confirming:
+                    continue
+                raise
+            except Exception:
+                self.pool.discard(s)
+                raise
+            self.pool.release(self.ip_address, s)
+            return response
+
+    def _write(self, data, force, **state):
+        # Skip the write if the shadow says the controller is already in this state.
+        if not force and all(self.shadow.get(self.ip_address, key) == value
+                             for key, value in state.items()):
+            log.debug("%s already has %s; skipping", self.ip_address, state)
+            return
+        self._send_state(data, state)
+
+    def _send_state(self, data, state, response_length=0, deadline=None):
+        # Send frames that change the controller and record the change in the shadow: from the
+        # controller's own Status when one came back, else as sent. Returns that Status or None.
         try:
-            s.connect((self.ip_address, API_PORT))
-            s.send(pack(">" + "B" * len(payload), *payload))
-        finally:
-            s.close()
+            response = self._exchange(data, response_length, deadline, confirm_reused=True)
+            status = _decode_status(response) if response else None
+        except Exception:
+            self.shadow.forget(self.ip_address)
+            raise
+        if status is None:
+            self.shadow.update(self.ip_address, **state)
+        else:
+            self.shadow.seed(self.ip_address, status)
+        return status
 
-    def on(self):
-        self._send_bytes(0x71, 0x23, 0x0F)
+    def on(self, force=False):
+        self._write(ON_FRAME, force, power=True)
         return self
 
-    def off(self):
-        self._send_bytes(0x71, 0x24, 0x0F)
+    def off(self, force=False):
+        self._write(OFF_FRAME, force, power=False)
         return self
 
-    def rgbw(self, r, g, b, w):
-        packet_id = 0x31
-        unused_payload = 0
-        remote_or_local = 0x0F
-        self._send_bytes(packet_id, r, g, b, w, unused_payload, remote_or_local)
+    def rgbw(self, r, g, b, w, force=False):
+        self._write(_rgbw_frame(r, g, b, w), force, rgbw=(r, g, b, w))
         return self
 
+    @staticmethod
+    def compile(color=None, power=None):
+        """Build the frames for an apply() once, to send any number of times with send_compiled().
+
+        Returns a tuple of (state key, value, frame) in sending order.
+        """
+        parts = []
+        if color is not None:
+            color = tuple(color)
+            parts.append(('rgbw', color, _rgbw_frame(*color)))
+        if power is not None:
+            parts.append(('power', power, ON_FRAME if power else OFF_FRAME))
+        return tuple(parts)
+
+    def apply(self, color=None, power=None, confirm=False, force=False, timeout=None):
+        """Set color and/or power in a single write over one connection.
+
+        ``color`` is an (r, g, b, w) tuple and ``power`` is True or False; either may be None to
+        leave it alone. The color frame is sent before the power frame, so a controller that is
+        being turned on comes up in the new color. Frames the shadow state says are no-ops are
+        left out unless ``force`` is True.
+
+        With ``confirm=True``, a status request is appended to the same write and the Status the
+        controller reports afterward is returned (waiting up to ``timeout`` seconds, default
+        ``status_timeout``). Otherwise returns None.
+        """
+        return self.send_compiled(self.compile(color, power), confirm, force, timeout)
+
+    def send_compiled(self, parts, confirm=False, force=False, timeout=None):
+        """Send frames built by Ufo.compile; otherwise the same as apply()."""
+        frames = []
+        state = {}
+        for key, value, frame in parts:
+            if force or self.shadow.get(self.ip_address, key) != value:
+                frames.append(frame)
+                state[key] = value
+        if not frames and not confirm:
+            log.debug("%s already has %s; skipping", self.ip_address,
+                      dict((key, value) for key, value, _ in parts))
+            return None
+
+        deadline = None
+        if confirm:
+            frames.append(STATUS_REQUEST)
+            deadline = monotonic() + (self.status_timeout if timeout is None else timeout)
+        status = self._send_state(b''.join(frames), state, STATUS_LENGTH if confirm else 0,
+                                  deadline)
+        return status if confirm else None
+
+
+Ufo.registry = DiscoveryRegistry(Ufo)
+
 
 if __name__ == "__main__":
-    Ufo.all_status()
+    print(Ufo.all_status())